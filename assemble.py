@@ -0,0 +1,138 @@
+"""Stitch the per-processor VOF blocks of one timestep into a single global array.
+
+Each PARIS rank writes its own subdomain to VOFttttt-ppppp.vtk. Instead of
+GroupDatasets + MergeBlocks (an unstructured grid with duplicated shared-face
+points) the blocks are placed by their node coordinates into one preallocated
+[i, j, k] array on the union rectilinear grid.
+"""
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import paris_vtk
+
+#global rectilinear grid: node coordinates along each axis and cell values [i, j, k]
+VofGrid = namedtuple('VofGrid', ['x', 'y', 'z', 'vof'])
+
+#extents are (i0, i1, j0, j1, k0, k1) cell ranges per block, gaps the number of
+#cells no block covers, overlaps (block_a, block_b, cells) for every intersecting pair
+AssemblyReport = namedtuple('AssemblyReport', ['extents', 'gaps', 'overlaps'])
+
+
+def _map(func, items, threads):
+    #list(map(func, items)), spread over a thread pool when threads > 1
+    if threads <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(threads, len(items))) as pool:
+        return list(pool.map(func, items))
+
+
+def timestep_files(directory, tstep, num_proc):
+    #the subdomain files of one timestep, in processor order
+    return [os.path.join(directory, 'VOF%05d-%05d.vtk' % (tstep, proc)) for proc in range(num_proc)]
+
+
+def _merge_axis(axes):
+    #union of the block node coordinates along one axis, coincident nodes collapsed
+    tol = 1e-6*min(np.min(np.diff(a)) if a.size > 1 else np.inf for a in axes)
+    if not np.isfinite(tol):
+        tol = 1e-12
+    nodes = np.unique(np.concatenate(axes))
+    keep = np.concatenate(([True], np.diff(nodes) > tol))
+    return nodes[keep], tol
+
+
+def block_extents(blocks):
+    """Global node coordinates and the cell extent of every block.
+
+    Returns (x, y, z, extents) with extents an (nblocks, 6) int array of
+    (i0, i1, j0, j1, k0, k1). Raises ValueError if a block's nodes do not
+    line up with the union grid.
+    """
+    axes = []
+    extents = np.zeros((len(blocks), 6), dtype=np.int64)
+    for axis, attr in enumerate('xyz'):
+        nodes, tol = _merge_axis([getattr(b, attr) for b in blocks])
+        for n, block in enumerate(blocks):
+            coords = getattr(block, attr)
+            start = int(np.searchsorted(nodes, coords[0] - tol))
+            stop = start + coords.size
+            if stop > nodes.size or not np.allclose(nodes[start:stop], coords, rtol=0, atol=tol):
+                raise ValueError('%s: %s nodes do not line up with the other blocks' % (block.path, attr))
+            extents[n, 2*axis] = start
+            extents[n, 2*axis + 1] = start + block.vof.shape[axis]
+        axes.append(nodes)
+    return axes[0], axes[1], axes[2], extents
+
+
+def _overlaps(extents):
+    #cells shared by every pair of blocks, from the extents alone
+    lo = np.maximum(extents[:, None, 0::2], extents[None, :, 0::2])
+    hi = np.minimum(extents[:, None, 1::2], extents[None, :, 1::2])
+    shared = np.prod(np.clip(hi - lo, 0, None), axis=2)
+    a, b = np.nonzero(np.triu(shared, k=1))
+    return [(int(p), int(q), int(shared[p, q])) for p, q in zip(a, b)]
+
+
+def assemble(blocks, out=None, dtype=np.float64, fill=0.0, threads=1):
+    """Write a list of VtkBlocks into one global VOF array.
+
+    `out` may be a preallocated array of the right shape (e.g. reused across
+    timesteps); otherwise one is allocated, of `dtype` (None keeps the dtype of
+    the block payloads, in native byte order). Cells no block covers keep `fill`.
+    With threads > 1 and no overlapping blocks the (disjoint) block copies,
+    which is where memory mapped payloads are actually read and byte swapped,
+    run in a thread pool. Returns (VofGrid, AssemblyReport).
+    """
+    x, y, z, extents = block_extents(blocks)
+    shape = (x.size - 1, y.size - 1, z.size - 1)
+    if out is None:
+        if dtype is None:
+            dtype = blocks[0].vof.dtype.newbyteorder('=')
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError('output array has shape %s, grid needs %s' % (out.shape, shape))
+
+    overlaps = _overlaps(extents)
+    if overlaps:
+        coverage = np.zeros(shape, dtype=np.uint8)
+        for block, (i0, i1, j0, j1, k0, k1) in zip(blocks, extents):
+            out[i0:i1, j0:j1, k0:k1] = block.vof
+            coverage[i0:i1, j0:j1, k0:k1] += 1
+        uncovered = coverage == 0
+        gaps = int(np.count_nonzero(uncovered))
+        out[uncovered] = fill
+    else:
+        gaps = int(np.prod(shape) - np.prod(extents[:, 1::2] - extents[:, 0::2], axis=1).sum())
+        if gaps:
+            out.fill(fill)
+
+        def place(n):
+            i0, i1, j0, j1, k0, k1 = extents[n]
+            out[i0:i1, j0:j1, k0:k1] = blocks[n].vof
+        _map(place, range(len(blocks)), threads)
+
+    report = AssemblyReport([tuple(int(v) for v in e) for e in extents], gaps, overlaps)
+    return VofGrid(x, y, z, out), report
+
+
+def assemble_files(paths, name='VOF', out=None, dtype=np.float64, threads=1):
+    """Read (memory mapped) and stitch the subdomain files of one timestep.
+
+    threads > 1 opens and decodes the files concurrently, which hides the
+    per-file open/metadata latency of network filesystems when a timestep is
+    split over hundreds of ranks.
+    """
+    blocks = _map(lambda path: paris_vtk.read_vof(path, name=name), list(paths), threads)
+    return assemble(blocks, out=out, dtype=dtype, threads=threads)
+
+
+def format_report(report):
+    #one line summary plus one line per problem, for printing from the scripts
+    lines = ['%d blocks, %d uncovered cells, %d overlapping pairs'
+             % (len(report.extents), report.gaps, len(report.overlaps))]
+    for a, b, cells in report.overlaps:
+        lines.append('  blocks %d and %d overlap by %d cells' % (a, b, cells))
+    return '\n'.join(lines)
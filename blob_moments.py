@@ -0,0 +1,211 @@
+"""Volume, centre of mass and moment of inertia of every blob in one reduction.
+
+Replaces the per-blob Threshold -> PythonCalculator -> CellCenters pipelines:
+given the blob label of every cell, all blobs are reduced at once with
+segmented sums (np.bincount), so the cost is O(cells) however many blobs the
+spray breaks up into.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+import corners
+
+HEADER = 'exp#,tstep,blob,vol,COM_x,COM_y,COM_z,Ixx,Iyy,Izz,Ixy,Ixz,Iyz'
+
+ESTIMATORS = ('center', 'arithmetic', 'geometric')
+
+#estimators that need the corner VOF and a subgrid cuboid per cell
+CORNER_ESTIMATORS = ('arithmetic', 'geometric')
+
+#per-cell subgrid cuboid of one estimator: liquid position, vector from it to
+#the nearest cell corner, and cuboid side lengths, each (N, 3)
+Cuboid = namedtuple('Cuboid', ['weighted_coords', 'aspect_ratio', 'side_lengths'])
+
+
+def select_estimators(names):
+    """Estimator names (a sequence or a comma separated string) in ESTIMATORS order."""
+    if isinstance(names, str):
+        names = names.split(',')
+    names = [name.strip() for name in names]
+    unknown = sorted(set(names) - set(ESTIMATORS))
+    if unknown or not names:
+        raise ValueError('unknown estimators %s, choose from %s' % (','.join(unknown), ','.join(ESTIMATORS)))
+    return tuple(name for name in ESTIMATORS if name in names)
+
+
+def needs_corners(estimators):
+    return any(name in CORNER_ESTIMATORS for name in estimators)
+
+
+def segment_sum(labels, values, num_blobs):
+    #sum values (N,) or (N, k) over the cells of each label 0..num_blobs-1
+    if values.ndim == 1:
+        return np.bincount(labels, weights=values, minlength=num_blobs)
+    return np.stack([np.bincount(labels, weights=values[:, c], minlength=num_blobs)
+                     for c in range(values.shape[1])], axis=1)
+
+
+def grid_cells(grid, labels, with_corners=False, node_values=None):
+    """Per-cell inputs for the reduction from a structured VofGrid.
+
+    Returns blob id, VOF, cell volume and cell centre (N, 3) of every cell
+    with labels >= 0. With with_corners=True also the corner coordinates (N, 8, 3)
+    and node-interpolated corner VOF (N, 8) the cuboid estimators need, i.e.
+    the same tuple paraview_backend.fetch_cells returns. node_values defaults
+    to corners.cell_to_point(grid.vof); a piece of a larger grid passes the
+    node values interpolated with its neighbours' cells.
+    """
+    i, j, k = np.nonzero(labels >= 0)
+    dx, dy, dz = np.diff(grid.x), np.diff(grid.y), np.diff(grid.z)
+    centers = np.column_stack((((grid.x[:-1] + grid.x[1:])/2)[i],
+                               ((grid.y[:-1] + grid.y[1:])/2)[j],
+                               ((grid.z[:-1] + grid.z[1:])/2)[k]))
+    cells = (labels[i, j, k], grid.vof[i, j, k], dx[i]*dy[j]*dz[k], centers)
+    if with_corners:
+        if node_values is None:
+            node_values = corners.cell_to_point(grid.vof)
+        cells += corners.cell_corners(grid, node_values, i, j, k)
+    return cells
+
+
+def _nearest_corner(corner_coords, position):
+    #corner of each cell closest to position (first one on ties, like the scripts)
+    dist = np.linalg.norm(corner_coords - position[:, None, :], axis=2)
+    nearest = np.argmin(dist, axis=1)
+    return corner_coords[np.arange(corner_coords.shape[0]), nearest]
+
+
+def cuboid_estimates(cvof, vol_cell, centers, corner_coords, corner_vof, estimators=CORNER_ESTIMATORS):
+    """Arithmetic and geometric subgrid cuboids of every cell at once.
+
+    corner_coords (N, 8, 3) and corner_vof (N, 8) are the coordinates and
+    interpolated VOF of each cell's corners, in any float dtype (sums are
+    taken in float64). Full cells (VOF == 1.0) start
+    from the cell centre, others from the VOF-weighted arithmetic/geometric
+    mean of their corners; the cuboid holding cvof*vol_cell is then pushed
+    into the nearest corner. Same arithmetic as the per-cell loop of
+    batch_paraview_python_test.py, including the arithmetic position being
+    shifted along the geometric aspect ratio.
+
+    Only the estimators asked for are computed, except that the geometric
+    cuboid is also built (and returned) for the arithmetic one, whose
+    position depends on it. Returns {'arithmetic': Cuboid, 'geometric': Cuboid},
+    or {} if neither is asked for.
+    """
+    if not needs_corners(estimators):
+        return {}
+    full = (cvof == 1.0)[:, None]
+    liquid = (cvof*vol_cell)[:, None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cvof_sum = corner_vof.sum(axis=1, dtype=np.float64)[:, None]
+        geometric = np.exp(np.einsum('np,npc->nc', corner_vof, np.log(corner_coords, dtype=np.float64),
+                                     dtype=np.float64)/cvof_sum)
+        geometric = np.where(full, centers, geometric)
+
+        corner = _nearest_corner(corner_coords, geometric)
+        aspect_ratio_geometric = corner - geometric
+        extent = np.abs(aspect_ratio_geometric)
+        side_lengths_geometric = (liquid/np.prod(extent, axis=1)[:, None])**(1/3)*extent
+        geometric = corner - aspect_ratio_geometric*(np.linalg.norm(side_lengths_geometric, axis=1)
+                                                     /np.linalg.norm(aspect_ratio_geometric, axis=1)/2)[:, None]
+        cuboids = {'geometric': Cuboid(geometric, aspect_ratio_geometric, side_lengths_geometric)}
+        if 'arithmetic' not in estimators:
+            return cuboids
+
+        arithmetic = np.einsum('np,npc->nc', corner_vof, corner_coords, dtype=np.float64)/cvof_sum
+        arithmetic = np.where(full, centers, arithmetic)
+        corner = _nearest_corner(corner_coords, arithmetic)
+        aspect_ratio_arithmetic = corner - arithmetic
+        extent = np.abs(aspect_ratio_arithmetic)
+        side_lengths_arithmetic = (liquid/np.prod(extent, axis=1)[:, None])**(1/3)*extent
+        arithmetic = corner - aspect_ratio_geometric*(np.linalg.norm(side_lengths_arithmetic, axis=1)
+                                                      /np.linalg.norm(aspect_ratio_arithmetic, axis=1)/2)[:, None]
+
+    cuboids['arithmetic'] = Cuboid(arithmetic, aspect_ratio_arithmetic, side_lengths_arithmetic)
+    return cuboids
+
+
+def blob_com(labels, weights, positions, num_blobs):
+    #volume (B,) and centre of mass (B, 3) of every blob
+    vol = segment_sum(labels, weights, num_blobs)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        com = segment_sum(labels, weights[:, None]*positions, num_blobs)/vol[:, None]
+    return vol, com
+
+
+def blob_moments(labels, weights, positions, num_blobs, reference=None, extra_diagonal=None):
+    """Reduce per-cell masses to per-blob volume, COM and inertia tensor.
+
+    labels: (N,) blob index of each cell, 0..num_blobs-1
+    weights: (N,) liquid volume of each cell (cvof*vol_cell)
+    positions: (N, 3) where each cell's liquid is taken to sit
+    reference: optional (num_blobs, 3) point the inertia is taken about,
+        defaults to the blob COM
+    extra_diagonal: optional (N, 3) per-cell additions to Ixx, Iyy, Izz
+        (e.g. the own inertia of a subgrid cuboid)
+
+    Returns vol (B,), com (B, 3) and inertia (B, 6) ordered
+    Ixx, Iyy, Izz, Ixy, Ixz, Iyz.
+    """
+    vol, com = blob_com(labels, weights, positions, num_blobs)
+    if reference is None:
+        reference = com
+
+    #second pass about the reference point rather than raw x*x sums, which
+    #lose everything to cancellation for small blobs far from the origin
+    r = positions - reference[labels]
+    wr = weights[:, None]*r
+    second = segment_sum(labels, np.column_stack((wr*r, wr[:, 0]*r[:, 1], wr[:, 0]*r[:, 2], wr[:, 1]*r[:, 2])), num_blobs)
+    xx, yy, zz, xy, xz, yz = second.T
+    inertia = np.column_stack((yy + zz, xx + zz, xx + yy, -xy, -xz, -yz))
+    if extra_diagonal is not None:
+        inertia[:, :3] += segment_sum(labels, extra_diagonal, num_blobs)
+    return vol, com, inertia
+
+
+def estimator_moments(labels, cvof, vol_cell, centers, cuboids, num_blobs, estimators=ESTIMATORS):
+    """Moments for the liquid-position estimators of the analysis scripts.
+
+    cuboids is the dict from cuboid_estimates (unused for 'center' alone).
+    Reproduces visualization.py term for term: the geometric cuboid adds
+    1/12*m*(sy^2+sz^2, sx^2+sz^2, sx^2+sy^2), the arithmetic one adds
+    1/12*m*(sy^2+sz^2) to all three diagonal terms and its inertia is taken
+    about the geometric COM. Only the requested estimators are reduced (the
+    arithmetic one alone still needs the geometric COM, not its inertia).
+    Returns {estimator: (vol, com, inertia)}.
+    """
+    weights = cvof*vol_cell
+    results = {}
+    if 'center' in estimators:
+        results['center'] = blob_moments(labels, weights, centers, num_blobs)
+
+    if 'geometric' in estimators:
+        sq = cuboids['geometric'].side_lengths**2
+        cuboid = weights[:, None]/12*np.column_stack((sq[:, 1] + sq[:, 2], sq[:, 0] + sq[:, 2], sq[:, 0] + sq[:, 1]))
+        results['geometric'] = blob_moments(labels, weights, cuboids['geometric'].weighted_coords, num_blobs,
+                                            extra_diagonal=cuboid)
+
+    if 'arithmetic' in estimators:
+        if 'geometric' in results:
+            reference = results['geometric'][1]
+        else:
+            reference = blob_com(labels, weights, cuboids['geometric'].weighted_coords, num_blobs)[1]
+        sq = cuboids['arithmetic'].side_lengths**2
+        cuboid = np.repeat((weights/12*(sq[:, 1] + sq[:, 2]))[:, None], 3, axis=1)
+        results['arithmetic'] = blob_moments(labels, weights, cuboids['arithmetic'].weighted_coords, num_blobs,
+                                             reference=reference, extra_diagonal=cuboid)
+    return results
+
+
+def parallel_axis(vol, offset):
+    #inertia (B, 6) of point masses vol (B,) at offset (B, 3) from the reference point
+    dx, dy, dz = offset.T
+    return vol[:, None]*np.column_stack((dy*dy + dz*dz, dx*dx + dz*dz, dx*dx + dy*dy, -dx*dy, -dx*dz, -dy*dz))
+
+
+def moment_table(exp, tstep, vol, com, inertia):
+    #rows of exp#, tstep, blob, vol, COM_x..z, Ixx..Iyz as written to output_*.csv
+    num_blobs = vol.size
+    return np.column_stack((np.full(num_blobs, exp), np.full(num_blobs, tstep), np.arange(num_blobs),
+                            vol, com, inertia))
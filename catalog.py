@@ -0,0 +1,160 @@
+"""Index of the VOFttttt-ppppp.vtk files of one VTK directory.
+
+The directory is listed once, names are parsed with a regular expression
+(any zero padding) rather than fixed string slices, and every file's size
+and mtime (optionally also the byte offset of its VOF payload) is recorded.
+Timesteps with no files or only some of the processor files are reported
+instead of being assumed present. The index is persisted as a small JSON
+sidecar next to the directory (VTK.index.json) and reused while the
+directory's mtime is unchanged, so re-runs over 100k+ files on a network
+filesystem start without listing or stat-ing anything.
+"""
+import json
+import os
+import re
+import time
+from collections import namedtuple
+
+import paris_vtk
+
+VOF_NAME = re.compile(r'^VOF(\d+)-(\d+)\.vtk$')
+
+#bumped whenever the sidecar layout changes, older sidecars are rescanned
+INDEX_VERSION = 1
+
+#a directory modified this recently may still be receiving files in the same
+#mtime tick (NFS mtimes can be whole seconds), so its index is not persisted
+SETTLE_SECONDS = 2.0
+
+#one subdomain file; offset is the byte offset of the binary VOF payload
+#(None for ASCII files or when headers were not scanned)
+VofFile = namedtuple('VofFile', ['tstep', 'proc', 'name', 'size', 'mtime_ns', 'offset'])
+
+
+def experiment_vtk_dir(top_dir, name):
+    #VTK directory of the experiment `name` of a sweep
+    return os.path.join(top_dir, name, 'VTK')
+
+
+def find_experiments(top_dir):
+    #experiment directories of a sweep (those holding a VTK directory), sorted by name
+    return [name for name in sorted(os.listdir(top_dir)) if os.path.isdir(experiment_vtk_dir(top_dir, name))]
+
+
+def sidecar_path(vtk_dir):
+    return os.path.normpath(vtk_dir) + '.index.json'
+
+
+def _payload_offset(path, name='VOF'):
+    #byte offset of the binary array `name`, None for ASCII files
+    with open(path, 'rb') as f:
+        f.readline()
+        f.readline()
+        if f.readline().split()[:1] != [b'BINARY']:
+            return None
+    for array in paris_vtk.scan(path, name=name)['arrays']:
+        if array.name == name:
+            return array.offset
+    return None
+
+
+class Catalog:
+    """The VOF files of one VTK directory, grouped by timestep.
+
+    num_tstep and num_proc are one past the largest timestep and processor
+    numbers found; `timesteps` lists only the complete timesteps (all
+    num_proc files present), `missing` the timesteps below num_tstep with no
+    files at all and `partial` maps incomplete timesteps to their absent
+    processors.
+    """
+
+    def __init__(self, vtk_dir, files):
+        self.vtk_dir = vtk_dir
+        self.files = sorted(files)
+        self.by_tstep = {}
+        for entry in self.files:
+            self.by_tstep.setdefault(entry.tstep, {})[entry.proc] = entry
+        self.num_tstep = max(self.by_tstep, default=-1) + 1
+        self.num_proc = max((entry.proc for entry in self.files), default=-1) + 1
+        self.timesteps = [t for t in sorted(self.by_tstep) if len(self.by_tstep[t]) == self.num_proc]
+        self.missing = [t for t in range(self.num_tstep) if t not in self.by_tstep]
+        self.partial = {t: [p for p in range(self.num_proc) if p not in procs]
+                        for t, procs in sorted(self.by_tstep.items()) if len(procs) < self.num_proc}
+
+    @property
+    def complete(self):
+        return not self.missing and not self.partial
+
+    def paths(self, tstep):
+        #the subdomain files of one complete timestep, in processor order
+        procs = self.by_tstep.get(tstep, {})
+        if len(procs) != self.num_proc:
+            raise ValueError('%s: timestep %d has %d of %d processor files'
+                             % (self.vtk_dir, tstep, len(procs), self.num_proc))
+        return [os.path.join(self.vtk_dir, procs[p].name) for p in range(self.num_proc)]
+
+    def tstep_bytes(self, tstep):
+        return sum(entry.size for entry in self.by_tstep.get(tstep, {}).values())
+
+
+def scan(vtk_dir, headers=False):
+    """Catalog of vtk_dir from a fresh directory listing.
+
+    With headers=True every binary file's header is also parsed to record the
+    offset of its VOF payload.
+    """
+    files = []
+    with os.scandir(vtk_dir) as entries:
+        for entry in entries:
+            match = VOF_NAME.match(entry.name)
+            if match is None:
+                continue
+            stat = entry.stat()
+            offset = _payload_offset(entry.path) if headers else None
+            files.append(VofFile(int(match.group(1)), int(match.group(2)), entry.name,
+                                 stat.st_size, stat.st_mtime_ns, offset))
+    return Catalog(vtk_dir, files)
+
+
+def load(vtk_dir, headers=False, refresh=False):
+    """Catalog of vtk_dir, from the sidecar index when it is still valid.
+
+    The sidecar is trusted while the directory mtime it recorded matches
+    (files added, removed or renamed change it; rewriting a file in place
+    does not). Otherwise, or with refresh=True, the directory is rescanned
+    and the sidecar rewritten; a read-only directory just skips that.
+    """
+    dir_mtime_ns = os.stat(vtk_dir).st_mtime_ns
+    index = sidecar_path(vtk_dir)
+    if not refresh and os.path.exists(index):
+        try:
+            with open(index) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+        if (stored.get('version') == INDEX_VERSION and stored.get('dir_mtime_ns') == dir_mtime_ns
+                and (stored.get('headers') or not headers)):
+            return Catalog(vtk_dir, [VofFile(*entry) for entry in stored['files']])
+
+    catalog = scan(vtk_dir, headers)
+    if time.time() - dir_mtime_ns*1e-9 > SETTLE_SECONDS:
+        stored = dict(version=INDEX_VERSION, dir_mtime_ns=dir_mtime_ns, headers=headers,
+                      files=[list(entry) for entry in catalog.files])
+        try:
+            with open(index + '.tmp', 'w') as f:
+                json.dump(stored, f, separators=(',', ':'))
+            os.replace(index + '.tmp', index)
+        except OSError:
+            pass
+    return catalog
+
+
+def format_report(catalog):
+    #one line summary plus the missing and partial timesteps, for printing from the scripts
+    lines = ['%s: %d timesteps x %d processes, %d complete'
+             % (catalog.vtk_dir, catalog.num_tstep, catalog.num_proc, len(catalog.timesteps))]
+    if catalog.missing:
+        lines.append('  missing timesteps: %s' % ' '.join(str(t) for t in catalog.missing))
+    for tstep, procs in catalog.partial.items():
+        lines.append('  timestep %d is missing processors %s' % (tstep, ' '.join(str(p) for p in procs)))
+    return '\n'.join(lines)
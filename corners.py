@@ -0,0 +1,58 @@
+"""Cell-to-point interpolation and cell corners on the structured grid.
+
+Replaces CellDatatoPointData on the merged unstructured grid: every node
+gets the plain average of the cells that touch it (8 inside, 4 on a face,
+2 on an edge, 1 at a corner of the domain), which is what the filter does
+with equal weights. The 2x2x2 box sum is separable, so it is three
+pairwise sums along the axes instead of eight shifted copies. Corners of
+cell (i, j, k) are simply the nodes (i+di, j+dj, k+dk); no point ids or
+connectivity array are involved.
+"""
+import numpy as np
+
+#(di, dj, dk) of the 8 corners in VTK voxel order (x fastest), the order the
+#scripts see the points of the merged grid in
+CORNER_OFFSETS = np.array([(di, dj, dk) for dk in (0, 1) for dj in (0, 1) for di in (0, 1)])
+
+
+def _pair_sum(values, axis):
+    #sum of the (up to) two cells on either side of every node along one axis
+    shape = list(values.shape)
+    shape[axis] += 1
+    out = np.zeros(shape)
+    lower = [slice(None)]*values.ndim
+    upper = [slice(None)]*values.ndim
+    lower[axis] = slice(None, -1)
+    upper[axis] = slice(1, None)
+    out[tuple(lower)] += values
+    out[tuple(upper)] += values
+    return out
+
+
+def _pair_count(n):
+    #number of cells touching each of the n+1 nodes along one axis
+    count = np.full(n + 1, 2.0)
+    count[0] = count[-1] = 1.0
+    return count
+
+
+def cell_to_point(vof):
+    """Node values (nx+1, ny+1, nz+1) averaged from the cell values (nx, ny, nz)."""
+    nx, ny, nz = vof.shape
+    total = _pair_sum(_pair_sum(_pair_sum(vof, 0), 1), 2)
+    total /= _pair_count(nx)[:, None, None]
+    total /= _pair_count(ny)[None, :, None]
+    total /= _pair_count(nz)[None, None, :]
+    return total
+
+
+def cell_corners(grid, node_values, i, j, k):
+    """Corner coordinates (N, 8, 3) and corner values (N, 8) of cells (i, j, k).
+
+    node_values comes from cell_to_point(grid.vof); corners are in
+    CORNER_OFFSETS order.
+    """
+    di, dj, dk = CORNER_OFFSETS.T
+    ci, cj, ck = i[:, None] + di, j[:, None] + dj, k[:, None] + dk
+    coords = np.stack((grid.x[ci], grid.y[cj], grid.z[ck]), axis=2)
+    return coords, node_values[ci, cj, ck]
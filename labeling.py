@@ -0,0 +1,173 @@
+"""Connected-component labelling of the VOF field directly on the structured grid.
+
+Replaces Threshold + Connectivity (which first turns the grid into an
+unstructured mesh). Cells with lower <= VOF <= upper are grouped into blobs
+with 6, 18 or 26 connectivity, optionally across periodic boundaries.
+
+Labels follow the Connectivity filter's RegionId convention: -1 for empty
+cells and 0..n-1 for blobs, numbered in the order their first cell appears
+in VTK (x fastest) order. scipy.ndimage is used for the bulk labelling when
+it is installed; otherwise a NumPy union-find does the same job more slowly.
+"""
+import itertools
+
+import numpy as np
+
+try:
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
+
+CONNECTIVITY = {6: 1, 18: 2, 26: 3}
+
+
+def neighbour_offsets(connectivity=26, half=True):
+    """(di, dj, dk) steps to the neighbours of a cell.
+
+    With half=True only one of each +d/-d pair is returned, which is enough to
+    visit every neighbouring pair once.
+    """
+    if connectivity not in CONNECTIVITY:
+        raise ValueError('connectivity must be 6, 18 or 26, not %r' % (connectivity,))
+    reach = CONNECTIVITY[connectivity]
+    offsets = [d for d in itertools.product((-1, 0, 1), repeat=3) if 0 < sum(map(abs, d)) <= reach]
+    if half:
+        offsets = [d for d in offsets if d > (0, 0, 0)]
+    return offsets
+
+
+def threshold_mask(vof, lower=1.0e-10, upper=1.0):
+    #cells counted as liquid, inclusive on both ends like ThresholdRange
+    return (vof >= lower) & (vof <= upper)
+
+
+def neighbour_pairs(a, b, offset, wrap=(False, False, False)):
+    """Values of a[p] and b[p + offset] for every p where both are >= 0.
+
+    a and b have the same shape; axes flagged in `wrap` are periodic, the
+    others are clipped at the edges.
+    """
+    src = []
+    dst = []
+    for axis, (d, n) in enumerate(zip(offset, a.shape)):
+        if d and wrap[axis]:
+            b = np.roll(b, -d, axis=axis)
+            d = 0
+        src.append(slice(max(0, -d), n - max(0, d)))
+        dst.append(slice(max(0, d), n - max(0, -d)))
+    u = a[tuple(src)]
+    v = b[tuple(dst)]
+    keep = (u >= 0) & (v >= 0)
+    return u[keep], v[keep]
+
+
+def components(num_nodes, u, v, root=None):
+    """Union-find over an edge list, vectorised.
+
+    Returns root (num_nodes,) mapping every node to the smallest node of its
+    component. Roots are hooked onto the smaller root of every edge and the
+    forest is flattened by pointer jumping until no edge spans two trees.
+    `root` continues from an earlier, fully flattened result.
+    """
+    root = np.arange(num_nodes) if root is None else root.copy()
+    while u.size:
+        ru = root[u]
+        rv = root[v]
+        lo = np.minimum(ru, rv)
+        hi = np.maximum(ru, rv)
+        split = lo != hi
+        if not split.any():
+            break
+        np.minimum.at(root, hi[split], lo[split])
+        while True:
+            jumped = root[root]
+            if np.array_equal(jumped, root):
+                break
+            root = jumped
+        #edges inside one tree never matter again
+        u = u[split]
+        v = v[split]
+    return root
+
+
+def _provisional(mask, connectivity):
+    #label ids per cell (-1 empty) and how many, without periodic wrap
+    if ndimage is not None:
+        structure = ndimage.generate_binary_structure(3, CONNECTIVITY[connectivity])
+        labels, count = ndimage.label(mask, structure=structure)
+        return labels.astype(np.int64) - 1, count
+
+    #NumPy fallback: every liquid cell is a node, every liquid neighbour pair an
+    #edge, joined one offset at a time so only one offset's edges are held
+    count = int(np.count_nonzero(mask))
+    dtype = np.int32 if count < 2**31 else np.int64
+    nodes = np.full(mask.shape, -1, dtype=dtype)
+    nodes[mask] = np.arange(count, dtype=dtype)
+    root = np.arange(count, dtype=dtype)
+    for d in neighbour_offsets(connectivity):
+        u, v = neighbour_pairs(nodes, nodes, d)
+        root = components(count, u, v, root)
+    labels = np.full(mask.shape, -1, dtype=np.int64)
+    labels[mask] = root
+    return labels, count
+
+
+def periodic_pairs(labels, connectivity=26, periodic=(False, False, False)):
+    #label pairs that touch across the periodic faces of the domain
+    pairs_u = []
+    pairs_v = []
+    for axis in range(3):
+        if not periodic[axis] or labels.shape[axis] < 2:
+            continue
+        high = labels.take([-1], axis=axis)
+        low = labels.take([0], axis=axis)
+        for d in neighbour_offsets(connectivity, half=False):
+            if d[axis] != 1:
+                continue
+            lateral = tuple(0 if a == axis else d[a] for a in range(3))
+            u, v = neighbour_pairs(high, low, lateral, wrap=periodic)
+            pairs_u.append(u)
+            pairs_v.append(v)
+    if not pairs_u:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(pairs_u), np.concatenate(pairs_v)
+
+
+def finalize(provisional, root):
+    """Turn provisional ids plus a root map into compact RegionId-style labels.
+
+    Returns (labels int32, counts) with labels numbered by first appearance in
+    x-fastest order and counts[n] the number of cells of blob n.
+    """
+    flat = provisional.ravel(order='F')
+    liquid = np.flatnonzero(flat >= 0)
+    #first cell of every root in one pass; only the roots, not the liquid cells, are then sorted
+    first = np.full(root.size, flat.size, dtype=np.int64)
+    np.minimum.at(first, root[flat[liquid]], liquid)
+    present = np.flatnonzero(first < flat.size)
+    lookup = np.full(root.size, -1, dtype=np.int32)
+    lookup[present[np.argsort(first[present])]] = np.arange(present.size, dtype=np.int32)
+
+    labels = np.full(provisional.shape, -1, dtype=np.int32)
+    mask = provisional >= 0
+    labels[mask] = lookup[root[provisional[mask]]]
+    counts = np.bincount(labels[mask], minlength=present.size)
+    return labels, counts
+
+
+def label(vof, lower=1.0e-10, upper=1.0, connectivity=26, periodic=(False, False, False)):
+    """Label the blobs of a global [i, j, k] VOF array.
+
+    Returns (labels, counts): an int32 array the shape of vof holding -1 for
+    cells outside [lower, upper] and the blob index otherwise, and the number
+    of cells in each blob.
+    """
+    if connectivity not in CONNECTIVITY:
+        raise ValueError('connectivity must be 6, 18 or 26, not %r' % (connectivity,))
+    mask = threshold_mask(vof, lower, upper)
+    provisional, count = _provisional(mask, connectivity)
+    root = np.arange(count)
+    if any(periodic):
+        u, v = periodic_pairs(provisional, connectivity, periodic)
+        root = components(count, u, v)
+    return finalize(provisional, root)
@@ -0,0 +1,7 @@
+"""Memory probes of the running process, for the progress lines of the drivers."""
+import resource
+
+
+def peak_rss_bytes():
+    #high-water mark of this process's resident memory (ru_maxrss is KiB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
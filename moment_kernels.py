@@ -0,0 +1,273 @@
+"""Compiled (Numba) kernels for the per-cell estimator and moment work, NumPy otherwise.
+
+The NumPy route (blob_moments.grid_cells -> cuboid_estimates ->
+estimator_moments) materialises per-cell arrays: corner coordinates
+(N, 8, 3), their logarithms, corner distances and one positions array per
+estimator. With Numba installed the same arithmetic runs cell by cell in
+two fused passes over the labelled cells, spread over all cores: the first
+accumulates each blob's volume and weighted positions (COM), the second
+the second moments and cuboid inertia about the COM. Cell positions are
+recomputed in the second pass rather than stored, so memory is the grid
+plus one (blobs x columns) accumulator per thread. Results agree with the
+NumPy route to rounding.
+
+    moments = moment_kernels.grid_moments(grid, labels, num_blobs, estimators)
+"""
+import numpy as np
+
+import blob_moments
+import corners
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+KERNELS = ('auto', 'numpy', 'numba')
+
+#the per-thread accumulators of one pass may use at most this many bytes;
+#with very many blobs fewer threads share the work instead
+ACCUMULATOR_BYTES = 1 << 28
+
+#accumulator columns: volume + 3 COM sums per estimator, then 6 second
+#moments + 3 cuboid diagonal terms per estimator
+_COM_COLUMNS = 1 + 3*len(blob_moments.ESTIMATORS)
+_MOMENT_COLUMNS = 9*len(blob_moments.ESTIMATORS)
+
+
+def use_numba(kernels='auto'):
+    #whether the compiled kernels run for this `kernels` setting
+    if kernels not in KERNELS:
+        raise ValueError('kernels must be one of %s, not %r' % (', '.join(KERNELS), kernels))
+    if kernels == 'numba' and numba is None:
+        raise ImportError('numba is not installed, use kernels="numpy" (or "auto")')
+    return numba is not None and kernels != 'numpy'
+
+
+if numba is not None:
+    _jit = numba.njit(cache=True, error_model='numpy')
+    _parallel_jit = numba.njit(parallel=True, cache=True, error_model='numpy')
+
+    @_jit
+    def _nearest(cc, px, py, pz):
+        #index of the corner closest to (px, py, pz), the first one on ties
+        best = 0
+        best_dist = np.inf
+        for p in range(8):
+            dx = cc[p, 0] - px
+            dy = cc[p, 1] - py
+            dz = cc[p, 2] - pz
+            dist = np.sqrt(dx*dx + dy*dy + dz*dz)
+            if dist < best_dist:
+                best = p
+                best_dist = dist
+        return best
+
+    @_jit
+    def _estimate(cvof, vol_cell, cx, cy, cz, cc, cv, want, pos, diag):
+        #liquid position pos[e] and own cuboid inertia diag[e] of one cell, e in ESTIMATORS order;
+        #cell by cell the same arithmetic as blob_moments.cuboid_estimates, in float64 whatever the corner dtype
+        pos[0, 0] = cx
+        pos[0, 1] = cy
+        pos[0, 2] = cz
+        if not (want[1] or want[2]):
+            return
+        liquid = cvof*vol_cell
+        full = cvof == 1.0
+        cvof_sum = 0.0
+        for p in range(8):
+            cvof_sum += cv[p]
+
+        if full:
+            gx, gy, gz = cx, cy, cz
+        else:
+            lx = ly = lz = 0.0
+            for p in range(8):
+                lx += np.float64(cv[p])*np.log(np.float64(cc[p, 0]))
+                ly += np.float64(cv[p])*np.log(np.float64(cc[p, 1]))
+                lz += np.float64(cv[p])*np.log(np.float64(cc[p, 2]))
+            gx, gy, gz = np.exp(lx/cvof_sum), np.exp(ly/cvof_sum), np.exp(lz/cvof_sum)
+        q = _nearest(cc, gx, gy, gz)
+        agx, agy, agz = cc[q, 0] - gx, cc[q, 1] - gy, cc[q, 2] - gz
+        f = (liquid/(abs(agx)*abs(agy)*abs(agz)))**(1/3)
+        sx, sy, sz = f*abs(agx), f*abs(agy), f*abs(agz)
+        scale = np.sqrt(sx*sx + sy*sy + sz*sz)/np.sqrt(agx*agx + agy*agy + agz*agz)/2
+        pos[2, 0] = cc[q, 0] - agx*scale
+        pos[2, 1] = cc[q, 1] - agy*scale
+        pos[2, 2] = cc[q, 2] - agz*scale
+        diag[2, 0] = liquid/12*(sy*sy + sz*sz)
+        diag[2, 1] = liquid/12*(sx*sx + sz*sz)
+        diag[2, 2] = liquid/12*(sx*sx + sy*sy)
+        if not want[1]:
+            return
+
+        if full:
+            ax, ay, az = cx, cy, cz
+        else:
+            ax = ay = az = 0.0
+            for p in range(8):
+                ax += np.float64(cv[p])*cc[p, 0]
+                ay += np.float64(cv[p])*cc[p, 1]
+                az += np.float64(cv[p])*cc[p, 2]
+            ax, ay, az = ax/cvof_sum, ay/cvof_sum, az/cvof_sum
+        q = _nearest(cc, ax, ay, az)
+        aax, aay, aaz = cc[q, 0] - ax, cc[q, 1] - ay, cc[q, 2] - az
+        f = (liquid/(abs(aax)*abs(aay)*abs(aaz)))**(1/3)
+        sx, sy, sz = f*abs(aax), f*abs(aay), f*abs(aaz)
+        #shifted along the geometric aspect ratio, as in the scripts
+        scale = np.sqrt(sx*sx + sy*sy + sz*sz)/np.sqrt(aax*aax + aay*aay + aaz*aaz)/2
+        pos[1, 0] = cc[q, 0] - agx*scale
+        pos[1, 1] = cc[q, 1] - agy*scale
+        pos[1, 2] = cc[q, 2] - agz*scale
+        diag[1, 0] = diag[1, 1] = diag[1, 2] = liquid/12*(sy*sy + sz*sz)
+
+    @_jit
+    def _add(acc, b, phase, w, pos, diag, ref, want):
+        #phase 0: volume and COM sums, phase 1: moments about ref[e, b] plus cuboid terms
+        if phase == 0:
+            acc[b, 0] += w
+            for e in range(3):
+                if want[e]:
+                    for c in range(3):
+                        acc[b, 1 + 3*e + c] += w*pos[e, c]
+            return
+        for e in range(3):
+            if want[e]:
+                rx = pos[e, 0] - ref[e, b, 0]
+                ry = pos[e, 1] - ref[e, b, 1]
+                rz = pos[e, 2] - ref[e, b, 2]
+                wx = w*rx
+                wy = w*ry
+                o = 9*e
+                acc[b, o] += wx*rx
+                acc[b, o + 1] += wy*ry
+                acc[b, o + 2] += w*rz*rz
+                acc[b, o + 3] += wx*ry
+                acc[b, o + 4] += wx*rz
+                acc[b, o + 5] += wy*rz
+                acc[b, o + 6] += diag[e, 0]
+                acc[b, o + 7] += diag[e, 1]
+                acc[b, o + 8] += diag[e, 2]
+
+    @_parallel_jit
+    def _grid_pass(labels, vof, node, x, y, z, want, phase, ref, acc):
+        #walk the labelled cells of the grid, each thread over its own range of i into acc[chunk]
+        nchunks = acc.shape[0]
+        nx, ny, nz = labels.shape
+        for chunk in numba.prange(nchunks):
+            pos = np.zeros((3, 3))
+            diag = np.zeros((3, 3))
+            cc = np.zeros((8, 3))
+            cv = np.zeros(8)
+            for i in range(chunk*nx//nchunks, (chunk + 1)*nx//nchunks):
+                for j in range(ny):
+                    for k in range(nz):
+                        b = labels[i, j, k]
+                        if b < 0:
+                            continue
+                        if want[1] or want[2]:
+                            #corner p is node (i+di, j+dj, k+dk) with p = di + 2*dj + 4*dk (voxel order)
+                            for p in range(8):
+                                di, dj, dk = p & 1, (p >> 1) & 1, p >> 2
+                                cc[p, 0] = x[i + di]
+                                cc[p, 1] = y[j + dj]
+                                cc[p, 2] = z[k + dk]
+                                cv[p] = node[i + di, j + dj, k + dk]
+                        cvof = vof[i, j, k]
+                        vol_cell = (x[i + 1] - x[i])*(y[j + 1] - y[j])*(z[k + 1] - z[k])
+                        _estimate(cvof, vol_cell, (x[i] + x[i + 1])/2, (y[j] + y[j + 1])/2, (z[k] + z[k + 1])/2,
+                                  cc, cv, want, pos, diag)
+                        _add(acc[chunk], b, phase, cvof*vol_cell, pos, diag, ref, want)
+
+    @_parallel_jit
+    def _cells_pass(labels, cvof, vol_cell, centers, corner_coords, corner_vof, want, phase, ref, acc):
+        #the same over per-cell arrays, each thread over its own range of cells
+        nchunks = acc.shape[0]
+        n = labels.size
+        for chunk in numba.prange(nchunks):
+            pos = np.zeros((3, 3))
+            diag = np.zeros((3, 3))
+            for m in range(chunk*n//nchunks, (chunk + 1)*n//nchunks):
+                cc = corner_coords[m] if want[1] or want[2] else corner_coords[0]
+                cv = corner_vof[m] if want[1] or want[2] else corner_vof[0]
+                _estimate(cvof[m], vol_cell[m], centers[m, 0], centers[m, 1], centers[m, 2], cc, cv, want, pos, diag)
+                _add(acc[chunk], labels[m], phase, cvof[m]*vol_cell[m], pos, diag, ref, want)
+
+
+def _want(estimators):
+    #estimators to evaluate per cell, in ESTIMATORS order; the arithmetic one needs the geometric COM
+    want = np.array([name in estimators for name in blob_moments.ESTIMATORS])
+    want[2] |= want[1]
+    return want
+
+
+def _fused(run, num_blobs, estimators):
+    #two passes of run(phase, ref, acc) and the per-blob (vol, com, inertia) of every estimator
+    nchunks = max(1, min(numba.get_num_threads(), ACCUMULATOR_BYTES//(8*_MOMENT_COLUMNS*max(num_blobs, 1))))
+    ref = np.zeros((3, num_blobs, 3))
+    acc = np.zeros((nchunks, num_blobs, _COM_COLUMNS))
+    run(0, ref, acc)
+    sums = acc.sum(axis=0)
+    vol = sums[:, 0]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        com = sums[:, 1:].reshape(num_blobs, 3, 3)/vol[:, None, None]
+
+    #inertia about each estimator's own COM, except arithmetic about the geometric one
+    ref[0], ref[1], ref[2] = com[:, 0], com[:, 2], com[:, 2]
+    acc = np.zeros((nchunks, num_blobs, _MOMENT_COLUMNS))
+    run(1, ref, acc)
+    second = acc.sum(axis=0)
+
+    results = {}
+    for e, name in enumerate(blob_moments.ESTIMATORS):
+        if name not in estimators:
+            continue
+        xx, yy, zz, xy, xz, yz, cx, cy, cz = second[:, 9*e:9*e + 9].T
+        inertia = np.column_stack((yy + zz + cx, xx + zz + cy, xx + yy + cz, -xy, -xz, -yz))
+        results[name] = (vol, com[:, e], inertia)
+    return results
+
+
+def cell_moments(cells, num_blobs, estimators=blob_moments.ESTIMATORS, kernels='auto'):
+    """{estimator: (vol, com, inertia)} from per-cell arrays.
+
+    cells is the tuple blob_moments.grid_cells or paraview_backend.fetch_cells
+    returns: blob id, VOF, cell volume, centres and, unless only 'center' is
+    asked for, corner coordinates and corner VOF.
+    """
+    blob_id, cvof, vol_cell, centers = cells[:4]
+    with_corners = blob_moments.needs_corners(estimators)
+    if not use_numba(kernels):
+        cuboids = blob_moments.cuboid_estimates(*cells[1:], estimators=estimators) if with_corners else {}
+        return blob_moments.estimator_moments(blob_id, cvof, vol_cell, centers, cuboids, num_blobs, estimators)
+
+    want = _want(estimators)
+    corner_coords, corner_vof = cells[4:6] if with_corners else (np.zeros((1, 8, 3)), np.zeros((1, 8)))
+
+    def run(phase, ref, acc):
+        _cells_pass(blob_id, cvof, vol_cell, centers, corner_coords, corner_vof, want, phase, ref, acc)
+
+    return _fused(run, num_blobs, estimators)
+
+
+def grid_moments(grid, labels, num_blobs, estimators=blob_moments.ESTIMATORS, kernels='auto', node_values=None):
+    """{estimator: (vol, com, inertia)} of every blob of a labelled VofGrid.
+
+    With Numba the kernels walk the grid directly (corners addressed by
+    (i, j, k) offsets into the interpolated node VOF), otherwise this is
+    grid_cells followed by cell_moments. node_values is passed on as in
+    blob_moments.grid_cells.
+    """
+    if not use_numba(kernels):
+        cells = blob_moments.grid_cells(grid, labels, blob_moments.needs_corners(estimators), node_values)
+        return cell_moments(cells, num_blobs, estimators, 'numpy')
+
+    want = _want(estimators)
+    node = node_values
+    if node is None:
+        node = corners.cell_to_point(grid.vof) if want[2] else np.zeros((1, 1, 1))
+
+    def run(phase, ref, acc):
+        _grid_pass(labels, grid.vof, node, grid.x, grid.y, grid.z, want, phase, ref, acc)
+
+    return _fused(run, num_blobs, estimators)
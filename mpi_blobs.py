@@ -0,0 +1,209 @@
+"""Blob statistics over MPI ranks, across all nodes of an allocation.
+
+    mpirun -n 4 python mpi_blobs.py PARIS_Experiments/2_droplet_experiments
+    mpirun -n 64 python mpi_blobs.py PARIS_Experiments/2_droplet_experiments --split subdomains
+
+The native pipeline of vof_blobs.py (no render view, nothing fetched to a
+client) with the work shared out between the ranks of MPI.COMM_WORLD:
+
+  --split timesteps    the timesteps of all experiments are dealt round robin
+  --split experiments  whole experiments, largest first to the least loaded rank
+  --split subdomains   every timestep's subdomain files are dealt out; each rank
+                       labels and reduces its blocks (subdomains.label_block) and
+                       rank 0 stitches the gathered partial moments and face layers
+
+Results reach rank 0 through comm.gather and only rank 0 writes
+output_<estimator>.csv. With --split timesteps the tables are gathered after
+every round of timesteps, so they are written as they come. Without mpi4py
+this runs as a single rank; under pvbatch its bundled mpi4py is used.
+"""
+import argparse
+import sys
+import traceback
+
+import numpy as np
+
+import assemble
+import blob_moments
+import catalog
+import scheduler
+import subdomains
+import vof_blobs
+
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI = None
+
+
+class SingleRank:
+    """Stands in for MPI.COMM_WORLD without mpi4py: one rank, the collectives used here return their input."""
+
+    def Get_rank(self):
+        return 0
+
+    def Get_size(self):
+        return 1
+
+    def bcast(self, obj, root=0):
+        return obj
+
+    def gather(self, obj, root=0):
+        return [obj]
+
+    def Abort(self, errorcode=1):
+        raise SystemExit(errorcode)
+
+
+def world():
+    return MPI.COMM_WORLD if MPI is not None else SingleRank()
+
+
+def deal_largest_first(costs, size):
+    #rank of every job: largest first, each to the rank with the least work so far
+    load = np.zeros(size)
+    owner = np.zeros(len(costs), dtype=int)
+    for n in np.argsort(costs, kind='stable')[::-1]:
+        owner[n] = np.argmin(load)
+        load[owner[n]] += costs[n]
+    return owner
+
+
+def split_timesteps(comm, tasks, **options):
+    """Yield, on rank 0, the tables of every (vtk_dir, exp, tstep, paths) task in order.
+
+    Rank r analyses tasks r, r + size, ...; each round's tables are gathered
+    on rank 0. The other ranks yield nothing but must still exhaust the
+    generator to take part in the gathers.
+    """
+    rank, size = comm.Get_rank(), comm.Get_size()
+    for start in range(0, len(tasks), size):
+        mine = start + rank
+        tables = vof_blobs.analyze_timestep(*tasks[mine], **options) if mine < len(tasks) else None
+        gathered = comm.gather(tables, root=0)
+        if rank == 0:
+            yield from (tables for tables in gathered if tables is not None)
+
+
+def split_experiments(comm, experiments, prefetch_depth=0, **options):
+    """Yield, on rank 0, every scheduler.Experiment's tables in order.
+
+    Experiments are dealt largest first to the least loaded rank, analysed
+    there serially, and gathered on rank 0 once all are done.
+    """
+    rank, size = comm.Get_rank(), comm.Get_size()
+    owner = deal_largest_first([experiment.cost for experiment in experiments], size)
+    mine = {experiment.index: vof_blobs.analyze_experiment(experiment, prefetch_depth, **options)
+            for experiment, r in zip(experiments, owner) if r == rank}
+    gathered = comm.gather(mine, root=0)
+    if rank == 0:
+        tables = {}
+        for part in gathered:
+            tables.update(part)
+        yield from (tables[experiment.index] for experiment in experiments)
+
+
+def split_subdomains(comm, tasks, lower=1.0e-10, upper=1.0, connectivity=26, periodic=(False, False, False),
+                     estimators=blob_moments.ESTIMATORS, cache_dir=None, read_threads=1, kernels='auto'):
+    """Yield, on rank 0, the tables of every task in order, each timestep's blocks shared out between the ranks.
+
+    Rank 0 checks the result cache and reads the block layout, rank r labels
+    blocks r, r + size, ... and rank 0 gathers and stitches them.
+    """
+    rank, size = comm.Get_rank(), comm.Get_size()
+    options = dict(lower=lower, upper=upper, connectivity=connectivity, estimators=subdomains._needed(estimators),
+                   kernels=kernels)
+    for vtk_dir, exp, tstep, paths in tasks:
+        tables = plan = None
+        if rank == 0:
+            entry = vof_blobs._cache_entry(vtk_dir, paths, lower, upper, connectivity, periodic, estimators, cache_dir)
+            if entry is not None:
+                tables = entry[0].get(entry[1], tstep, entry[2], exp=exp)
+            if tables is None:
+                plan = subdomains.layout(paths, read_threads)
+        plan = comm.bcast(plan, root=0)
+        if plan is None:
+            if rank == 0:
+                yield tables
+            continue
+
+        x, y, z, extents, report = plan
+        jobs = subdomains.block_jobs(paths, x, y, z, extents)
+        blocks = [subdomains.label_block(*job, **options) for job in jobs[rank::size]]
+        gathered = comm.gather(blocks, root=0)
+        if rank != 0:
+            continue
+        ordered = [None]*len(jobs)
+        for r, part in enumerate(gathered):
+            ordered[r::size] = part
+        shape = (x.size - 1, y.size - 1, z.size - 1)
+        moments = subdomains.stitch_blocks(ordered, extents, shape, connectivity, periodic, estimators)
+        if report.gaps:
+            print('%s timestep %d: %s' % (vtk_dir, tstep, assemble.format_report(report)))
+        tables = {name: blob_moments.moment_table(exp, tstep, *moments[name]) for name in estimators}
+        if entry is not None:
+            entry[0].put(entry[1], tstep, entry[2], tables)
+        yield tables
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    vof_blobs.add_analysis_arguments(parser)
+    parser.add_argument('--split', choices=('timesteps', 'experiments', 'subdomains'), default='timesteps',
+                        help='what the ranks share out')
+    parser.add_argument('--slabs', action='store_true',
+                        help='stream every timestep out of core in z slabs that fit --memory-budget')
+    parser.add_argument('--memory-budget', type=float, default=1.0, help='GB per rank for --slabs')
+    args = parser.parse_args(argv)
+    if args.split == 'subdomains' and (args.store or args.slabs):
+        parser.error('--split subdomains reads the subdomain files, it does not combine with --store or --slabs')
+    return args
+
+
+def run(comm, argv=None):
+    args = parse_args(argv)
+    rank, size = comm.Get_rank(), comm.Get_size()
+    options = vof_blobs.analysis_options(args)
+    if args.slabs:
+        options['slab_budget'] = args.memory_budget*1e9
+
+    #rank 0 lists the experiments and catalogs, the others get the result
+    work = None
+    if rank == 0:
+        exps = catalog.find_experiments(args.experiments)
+        print('%s on %d ranks' % (exps, size))
+        if args.split == 'experiments':
+            work = scheduler.survey(args.experiments, exps)
+        else:
+            work = vof_blobs.timestep_tasks(args.experiments, exps)
+    work = comm.bcast(work, root=0)
+
+    if args.split == 'experiments':
+        tables = split_experiments(comm, work, **options)
+    elif args.split == 'subdomains':
+        del options['use_store']
+        tables = split_subdomains(comm, work, **options)
+    else:
+        tables = split_timesteps(comm, work, **options)
+    if rank == 0:
+        vof_blobs.write_tables(args, tables)
+    else:
+        for _ in tables:
+            pass
+
+
+def main(argv=None):
+    comm = world()
+    try:
+        run(comm, argv)
+    except Exception:
+        #one failing rank would leave the others waiting in a collective forever
+        if comm.Get_size() > 1:
+            traceback.print_exc()
+            sys.stderr.flush()
+            comm.Abort(1)
+        raise
+
+
+if __name__ == '__main__':
+    main()
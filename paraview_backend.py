@@ -0,0 +1,242 @@
+"""ParaView side of the blob analysis.
+
+Builds the reader -> merge -> interpolate -> threshold -> connectivity
+pipeline for one timestep, fetches the labelled cells to the client once and
+hands them over as NumPy arrays (dataset_adapter views), so nothing
+downstream calls GetValue/GetTuple per value. Either the pipeline is
+built and deleted again for every timestep (analyze_files), or built once per
+experiment and re-pointed at each timestep's files (Pipeline); in neither
+case does memory grow with run length. Needs pvpython.
+
+With a remote or parallel pvserver, reduce_files and ReductionPipeline
+instead end the pipeline in a ProgrammableFilter that reduces the labelled
+cells to per-blob moments on the server (server_reduction), so only a vtkTable
+of one row per blob crosses to the client.
+"""
+import os
+
+import numpy as np
+
+from paraview import servermanager
+from paraview.simple import (CellCenters, CellDatatoPointData, Connectivity, Delete, GroupDatasets, Hide,
+                             LegacyVTKReader, MergeBlocks, ProgrammableFilter, PythonCalculator, Show, Threshold)
+
+try:
+    from vtkmodules.numpy_interface import dataset_adapter as dsa
+except ImportError:
+    from vtk.numpy_interface import dataset_adapter as dsa
+
+import blob_moments
+import server_reduction
+
+#run by the reduction filter on the server; the modules are imported from this directory
+REDUCTION_SCRIPT = '''import sys
+if %(path)r not in sys.path:
+    sys.path.insert(0, %(path)r)
+import server_reduction
+table = server_reduction.reduce_dataset(self.GetInputDataObject(0, 0), %(estimators)r, %(kernels)r)
+self.GetOutputDataObject(0).ShallowCopy(server_reduction.gather_table(table))
+'''
+
+
+def cell_center_filters(connectivity):
+    #cell volume and cell centres of the labelled cells: [PythonCalculator, CellCenters]
+    volume = PythonCalculator(Input=connectivity)
+    volume.Expression = 'volume(inputs[0])'
+    volume.ArrayAssociation = 'Cell Data'
+    volume.ArrayName = 'volume'
+    return [volume, CellCenters(Input=volume)]
+
+
+def fetch_cells(cell_centers, connectivity, with_corners=True):
+    """Fetch cell centres and the labelled grid and wrap them as per-cell NumPy arrays.
+
+    The Connectivity input must carry cell VOF and point (corner) VOF, i.e.
+    come from CellDatatoPointData with PassCellData = 1. Returns blob_id,
+    cell_vof, cell_volume, cell centres (N, 3), corner coordinates (N, 8, 3)
+    and corner VOF (N, 8), ready for blob_moments. with_corners=False skips
+    fetching the labelled grid and returns only the first four.
+    """
+    #fetch point center data and point corner data from paraview backend, one transfer each
+    centers = dsa.WrapDataObject(servermanager.Fetch(cell_centers))
+
+    if centers.GetNumberOfPoints() == 0:
+        cells = (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros((0, 3)))
+        return cells + (np.zeros((0, 8, 3)), np.zeros((0, 8))) if with_corners else cells
+
+    blob_id = np.asarray(centers.PointData['RegionId']).astype(np.int64)
+    cells = (blob_id,
+             np.asarray(centers.PointData['VOF'], dtype=np.float64),
+             np.asarray(centers.PointData['volume'], dtype=np.float64),
+             np.asarray(centers.Points, dtype=np.float64))
+    if not with_corners:
+        return cells
+
+    corners = dsa.WrapDataObject(servermanager.Fetch(connectivity))
+    ids = server_reduction.corner_ids(corners.VTKObject)
+    #the gather already copies, in the data's own dtype; the kernels take float32 corners as they are
+    return cells + (np.asarray(corners.Points)[ids], np.asarray(corners.PointData['VOF'])[ids])
+
+
+def fetch_labelled_cells(connectivity, with_corners=True):
+    #fetch_cells for a Connectivity filter, creating and deleting the helper filters
+    helpers = cell_center_filters(connectivity)
+    try:
+        return fetch_cells(helpers[-1], connectivity, with_corners)
+    finally:
+        release(helpers)
+
+
+def reduction_filter(connectivity, estimators=blob_moments.ESTIMATORS, kernels='auto'):
+    """ProgrammableFilter reducing the labelled cells of connectivity to a per-blob vtkTable on the server.
+
+    The table holds partial moments (server_reduction.reduce_dataset), one
+    row per blob and server rank, all gathered on rank 0
+    (server_reduction.gather_table); fetch_moments combines them. The server
+    must see this directory and have NumPy (and Numba for kernels='numba').
+    """
+    reduction = ProgrammableFilter(Input=connectivity)
+    reduction.OutputDataSetType = 'vtkTable'
+    reduction.Script = REDUCTION_SCRIPT % dict(path=os.path.dirname(os.path.abspath(__file__)),
+                                               estimators=tuple(estimators), kernels=kernels)
+    return reduction
+
+
+def fetch_moments(reduction, estimators=blob_moments.ESTIMATORS):
+    #(num_blobs, {estimator: (vol, com, inertia)}) from one fetch of the reduction filter's table,
+    #rank 0's output, which holds the rows of every server rank
+    return server_reduction.table_moments(servermanager.Fetch(reduction, 0), estimators)
+
+
+def release(proxies):
+    #delete pipeline proxies (and their representations), downstream first
+    for proxy in reversed(proxies):
+        Delete(proxy)
+
+
+def build_pipeline(file_names, threshold_range=(1.0e-10, 1.0), view=None):
+    """Create the labelling pipeline for the subdomain files of one timestep.
+
+    Returns every proxy created, sources first, the Connectivity filter last.
+    Without a view (headless) no representation or geometry is ever created;
+    with one, the merged and interpolated data get hidden representations as
+    in the original trace.
+    """
+    readers = [LegacyVTKReader(FileNames=[name]) for name in file_names]
+    group_datasets = GroupDatasets(Input=readers)
+    merge_blocks = MergeBlocks(Input=group_datasets)
+
+    #Convert Cell Data to point data to get accurate representation of VOF values at corners
+    cell_corner_interp = CellDatatoPointData(Input=merge_blocks)
+    cell_corner_interp.PassCellData = 1
+
+    if view is not None:
+        for source in (merge_blocks, cell_corner_interp):
+            display = Show(source, view)
+            display.Representation = 'Surface'
+            display.SetScalarBarVisibility(view, False)
+            Hide(source, view)
+        view.Update()
+
+    #get VOF cells inside the threshold range and label the connected regions
+    find_blob_threshold = Threshold(Input=cell_corner_interp)
+    find_blob_threshold.Scalars = ['CELLS', 'VOF']
+    find_blob_threshold.ThresholdRange = list(threshold_range)
+    connectivity = Connectivity(Input=find_blob_threshold)
+
+    return readers + [group_datasets, merge_blocks, cell_corner_interp, find_blob_threshold, connectivity]
+
+
+def analyze_files(file_names, threshold_range=(1.0e-10, 1.0), view=None, with_corners=True):
+    """Labelled cells of one timestep, with nothing left behind in the session.
+
+    Returns (num_blobs, cells) where cells is the tuple from
+    fetch_labelled_cells.
+    """
+    proxies = build_pipeline(file_names, threshold_range, view)
+    try:
+        cells = fetch_labelled_cells(proxies[-1], with_corners)
+    finally:
+        release(proxies)
+    return _num_blobs(cells), cells
+
+
+def reduce_files(file_names, threshold_range=(1.0e-10, 1.0), view=None, estimators=blob_moments.ESTIMATORS,
+                 kernels='auto'):
+    """(num_blobs, {estimator: (vol, com, inertia)}) of one timestep, reduced on the server.
+
+    Like analyze_files, but only the per-blob table of reduction_filter is
+    fetched instead of the labelled cells.
+    """
+    proxies = build_pipeline(file_names, threshold_range, view)
+    try:
+        proxies.append(reduction_filter(proxies[-1], estimators, kernels))
+        return fetch_moments(proxies[-1], estimators)
+    finally:
+        release(proxies)
+
+
+def _num_blobs(cells):
+    return int(cells[0].max()) + 1 if cells[0].size else 0
+
+
+class Pipeline:
+    """The labelling pipeline of one experiment, built once.
+
+    Each timestep only re-points the readers' FileNames and re-executes, so
+    proxy construction and registration are paid once per experiment rather
+    than once per timestep. All timesteps must have the same number of files.
+    with_corners=False leaves the corner arrays out of every fetch.
+    """
+
+    def __init__(self, file_names, threshold_range=(1.0e-10, 1.0), view=None, with_corners=True):
+        self.view = view
+        self.with_corners = with_corners
+        self.proxies = build_pipeline(file_names, threshold_range, view)
+        self.readers = self.proxies[:len(file_names)]
+        self.connectivity = self.proxies[-1]
+        self.proxies += cell_center_filters(self.connectivity)
+        self.cell_centers = self.proxies[-1]
+
+    def analyze(self, file_names):
+        """(num_blobs, cells) for one timestep, as analyze_files returns."""
+        self._load(file_names)
+        cells = fetch_cells(self.cell_centers, self.connectivity, self.with_corners)
+        return _num_blobs(cells), cells
+
+    def _load(self, file_names):
+        #point the readers at one timestep's files
+        if len(file_names) != len(self.readers):
+            raise ValueError('pipeline was built for %d files per timestep, got %d'
+                             % (len(self.readers), len(file_names)))
+        for reader, name in zip(self.readers, file_names):
+            reader.FileNames = [name]
+        if self.view is not None:
+            self.view.Update()
+
+    def close(self):
+        release(self.proxies)
+        self.proxies = []
+
+
+class ReductionPipeline(Pipeline):
+    """Pipeline ending in the server-side reduction filter, built once per experiment.
+
+    analyze fetches only the per-blob table and returns the moments rather
+    than the labelled cells.
+    """
+
+    def __init__(self, file_names, threshold_range=(1.0e-10, 1.0), view=None, estimators=blob_moments.ESTIMATORS,
+                 kernels='auto'):
+        self.view = view
+        self.estimators = estimators
+        self.proxies = build_pipeline(file_names, threshold_range, view)
+        self.readers = self.proxies[:len(file_names)]
+        self.connectivity = self.proxies[-1]
+        self.proxies.append(reduction_filter(self.connectivity, estimators, kernels))
+        self.reduction = self.proxies[-1]
+
+    def analyze(self, file_names):
+        """(num_blobs, {estimator: (vol, com, inertia)}) for one timestep, as reduce_files returns."""
+        self._load(file_names)
+        return fetch_moments(self.reduction, self.estimators)
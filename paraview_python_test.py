@@ -1,6 +1,7 @@
 import numpy as np
 import os
-import glob
+
+import catalog
 
 #### import the simple module from the paraview
 from paraview.simple import *
@@ -8,25 +9,25 @@ from paraview.simple import *
 #### disable automatic camera reset on 'Show'
 paraview.simple._DisableFirstRenderCameraReset()
 
+# analysis only: no render view and no display proxies, runs under pvbatch without an OpenGL context
+# set to False to get the view and the (hidden) representations of the original trace
+headless = True
+
 # get active view
-renderView1 = GetActiveViewOrCreate('RenderView')
+renderView1 = None if headless else GetActiveViewOrCreate('RenderView')
 # uncomment following to set a specific view size
 # renderView1.ViewSize = [2751, 1034]
 
 
 #find all vof vtk files
 os.chdir('Kor_chi_03_h1500_128/out/VTK')
-vof_files = glob.glob('VOF*')
+vof_catalog = catalog.load(os.getcwd())
 
 #determine the number of timesteps and the number of processes (vtk files per timestep)
-num_proc = 0
-num_tstep = 0
-for ii in range(len(vof_files)):
-    num_tstep = max([num_tstep, int(vof_files[ii][3:8])])
-    num_proc = max([num_proc, int(vof_files[ii][9:14])])
-
-num_tstep = num_tstep + 1
-num_proc = num_proc + 1
+num_tstep = vof_catalog.num_tstep
+num_proc = vof_catalog.num_proc
+if not vof_catalog.complete:
+    raise SystemExit(catalog.format_report(vof_catalog))
 
 print(num_tstep)
 print(num_proc)
@@ -55,36 +56,38 @@ for ii in range(num_tstep):
     # create a new 'Merge Blocks'
     mergeBlocks.append(MergeBlocks(Input=groupDatasets[ii]))
 
-    # show data in view
-    mergeBlocksDisplay.append(Show(mergeBlocks[ii], renderView1))
+    if renderView1 is not None:
+        # show data in view
+        mergeBlocksDisplay.append(Show(mergeBlocks[ii], renderView1))
 
-    # trace defaults for the display properties.
-    mergeBlocksDisplay[ii].Representation = 'Surface'
+        # trace defaults for the display properties.
+        mergeBlocksDisplay[ii].Representation = 'Surface'
 
-    # show color bar/color legend
-    mergeBlocksDisplay[ii].SetScalarBarVisibility(renderView1, False)
+        # show color bar/color legend
+        mergeBlocksDisplay[ii].SetScalarBarVisibility(renderView1, False)
 
-    # hide data in view
-    Hide(mergeBlocks[ii], renderView1)
+        # hide data in view
+        Hide(mergeBlocks[ii], renderView1)
 
 
     #Convert Cell Data to point data to get accurate representation of VOF values at corners
     cell_corner_interp.append(CellDatatoPointData(Input=mergeBlocks[ii]))
     cell_corner_interp[ii].PassCellData = 1
-    # show data in view
-    cell_corner_interp_display.append(Show(cell_corner_interp[ii], renderView1))
+    if renderView1 is not None:
+        # show data in view
+        cell_corner_interp_display.append(Show(cell_corner_interp[ii], renderView1))
 
-    # trace defaults for the display properties.
-    cell_corner_interp_display[ii].Representation = 'Surface'
+        # trace defaults for the display properties.
+        cell_corner_interp_display[ii].Representation = 'Surface'
 
-    # show color bar/color legend
-    cell_corner_interp_display[ii].SetScalarBarVisibility(renderView1, False)
+        # show color bar/color legend
+        cell_corner_interp_display[ii].SetScalarBarVisibility(renderView1, False)
 
-    # hide data in view
-    Hide(cell_corner_interp_display[ii], renderView1)
+        # hide data in view
+        Hide(cell_corner_interp_display[ii], renderView1)
 
-    # update the view to ensure updated data information
-    renderView1.Update()
+        # update the view to ensure updated data information
+        renderView1.Update()
 
 
     # create a new 'Threshold' get VOF points greater than zero
@@ -97,7 +100,8 @@ for ii in range(num_tstep):
     # create a new 'Connectivity' perform connectivity labeling algorithm
     connectivity.append(Connectivity(Input=find_blob_threshold[ii]))
 
-    #get number of blobs
+    #get number of blobs, executing the pipeline here since no view update did
+    connectivity[ii].UpdatePipeline()
     Num_Blobs = int(connectivity[ii].PointData.GetArray("RegionId").GetRange()[1] + 1)
 
     threshold = []
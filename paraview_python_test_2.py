@@ -1,6 +1,7 @@
 import numpy as np
 import os
-import glob
+
+import catalog
 
 #### import the simple module from the paraview
 from paraview.simple import *
@@ -8,25 +9,28 @@ from paraview.simple import *
 #### disable automatic camera reset on 'Show'
 paraview.simple._DisableFirstRenderCameraReset()
 
+import memory_usage
+import paraview_backend
+
+# analysis only: no render view and no display proxies, runs under pvbatch without an OpenGL context
+# set to False to get the view and the (hidden) representations of the original trace
+headless = True
+
 # get active view
-renderView1 = GetActiveViewOrCreate('RenderView')
+renderView1 = None if headless else GetActiveViewOrCreate('RenderView')
 # uncomment following to set a specific view size
 # renderView1.ViewSize = [2751, 1034]
 
 
 #find all vof vtk files
 os.chdir('/home/cofphe/Documents/Kor_chi_03_h1500_128/out/VTK')
-vof_files = glob.glob('VOF*')
+vof_catalog = catalog.load(os.getcwd())
 
 #determine the number of timesteps and the number of processes (vtk files per timestep)
-num_proc = 0
-num_tstep = 0
-for ii in range(len(vof_files)):
-    num_tstep = max([num_tstep, int(vof_files[ii][3:8])])
-    num_proc = max([num_proc, int(vof_files[ii][9:14])])
-
-num_tstep = num_tstep + 1
-num_proc = num_proc + 1
+num_tstep = vof_catalog.num_tstep
+num_proc = vof_catalog.num_proc
+if not vof_catalog.complete:
+    raise SystemExit(catalog.format_report(vof_catalog))
 
 print(num_tstep)
 print(num_proc)
@@ -56,36 +60,38 @@ for ii in range(num_tstep):
     # create a new 'Merge Blocks'
     mergeBlocks = MergeBlocks(Input=groupDatasets)
 
-    # show data in view
-    mergeBlocksDisplay = Show(mergeBlocks, renderView1)
+    if renderView1 is not None:
+        # show data in view
+        mergeBlocksDisplay = Show(mergeBlocks, renderView1)
 
-    # trace defaults for the display properties.
-    mergeBlocksDisplay.Representation = 'Surface'
+        # trace defaults for the display properties.
+        mergeBlocksDisplay.Representation = 'Surface'
 
-    # show color bar/color legend
-    mergeBlocksDisplay.SetScalarBarVisibility(renderView1, False)
+        # show color bar/color legend
+        mergeBlocksDisplay.SetScalarBarVisibility(renderView1, False)
 
-    # hide data in view
-    Hide(mergeBlocks, renderView1)
+        # hide data in view
+        Hide(mergeBlocks, renderView1)
 
 
     #Convert Cell Data to point data to get accurate representation of VOF values at corners
     cell_corner_interp = CellDatatoPointData(Input=mergeBlocks)
     cell_corner_interp.PassCellData = 1
-    # show data in view
-    cell_corner_interp_display = Show(cell_corner_interp, renderView1)
+    if renderView1 is not None:
+        # show data in view
+        cell_corner_interp_display = Show(cell_corner_interp, renderView1)
 
-    # trace defaults for the display properties.
-    cell_corner_interp_display.Representation = 'Surface'
+        # trace defaults for the display properties.
+        cell_corner_interp_display.Representation = 'Surface'
 
-    # show color bar/color legend
-    cell_corner_interp_display.SetScalarBarVisibility(renderView1, False)
+        # show color bar/color legend
+        cell_corner_interp_display.SetScalarBarVisibility(renderView1, False)
 
-    # hide data in view
-    Hide(cell_corner_interp_display, renderView1)
+        # hide data in view
+        Hide(cell_corner_interp_display, renderView1)
 
-    # update the view to ensure updated data information
-    renderView1.Update()
+        # update the view to ensure updated data information
+        renderView1.Update()
 
 
     # create a new 'Threshold' get VOF points greater than zero
@@ -98,7 +104,8 @@ for ii in range(num_tstep):
     # create a new 'Connectivity' perform connectivity labeling algorithm
     connectivity = Connectivity(Input=find_blob_threshold)
 
-    #get number of blobs
+    #get number of blobs, executing the pipeline here since no view update did
+    connectivity.UpdatePipeline()
     Num_Blobs = int(connectivity.PointData.GetArray("RegionId").GetRange()[1] + 1)
 
     threshold = []
@@ -225,8 +232,10 @@ for ii in range(num_tstep):
             output_array_arithmetic = np.vstack((output_array_arithmetic, np.array(np.concatenate((np.array([ii]), np.array([kk]), COM_arithmetic, I_arithmetic), axis = None))))
             output_array_geometric = np.vstack((output_array_geometric, np.array(np.concatenate((np.array([ii]), np.array([kk]), COM_geometric, I_geometric), axis = None))))
 
-    Disconnect()
-    Connect()
+    #release this timestep's proxies (downstream first) instead of resetting the whole session
+    paraview_backend.release(vtk_files[:num_proc] + [groupDatasets, mergeBlocks, cell_corner_interp, find_blob_threshold, connectivity]
+                             + threshold + volume + cell_centers + coords_center + coords_corner)
+    print('timestep %d: peak memory %.0f MB' % (ii, memory_usage.peak_rss_bytes()/1e6))
 
 print(output_array_center)
 print(output_array_arithmetic)
@@ -0,0 +1,313 @@
+"""Plain NumPy reader for the legacy VTK files PARIS writes (VOFttttt-ppppp.vtk).
+
+Handles ASCII and BINARY STRUCTURED_POINTS / RECTILINEAR_GRID datasets. In
+binary mode the scalar payload is memory mapped instead of parsed, so opening
+a file costs a header scan and nothing else until the values are touched.
+ASCII payloads are parsed in bulk by NumPy, and ASCII arrays other than the
+requested one are skipped without being parsed; to_binary rewrites ASCII
+files as binary once so they never need parsing again.
+
+    python paris_vtk.py PARIS_Experiments/2_droplet_experiments/run1/VTK
+"""
+import argparse
+import glob
+import os
+import re
+import warnings
+from collections import namedtuple
+from mmap import ACCESS_READ, mmap as _file_map
+
+import numpy as np
+
+#legacy VTK type names -> numpy type codes (binary legacy files are big endian)
+VTK_TYPES = {
+    'bit': None,
+    'char': 'i1',
+    'unsigned_char': 'u1',
+    'short': 'i2',
+    'unsigned_short': 'u2',
+    'int': 'i4',
+    'unsigned_int': 'u4',
+    'long': 'i8',
+    'unsigned_long': 'u8',
+    'vtktypeint64': 'i8',
+    'vtktypeuint64': 'u8',
+    'float': 'f4',
+    'double': 'f8',
+}
+
+#a keyword starting the line after an ASCII array, i.e. where its values end
+_ASCII_KEYWORD = re.compile(rb'\n(?:SCALARS|VECTORS|NORMALS|TENSORS|FIELD|CELL_DATA|POINT_DATA|LOOKUP_TABLE|'
+                            rb'COLOR_SCALARS|TEXTURE_COORDINATES|METADATA|[XYZ]_COORDINATES)\b')
+
+#one subdomain file: node coordinates along each axis and the scalar indexed [i, j, k]
+VtkBlock = namedtuple('VtkBlock', ['path', 'x', 'y', 'z', 'vof'])
+
+#where an array lives in the file; offset is None for ASCII payloads
+ArrayInfo = namedtuple('ArrayInfo', ['name', 'association', 'vtk_type', 'count', 'offset'])
+
+
+def _next_line(f):
+    #return the next non-blank header line split into tokens, [] at EOF
+    while True:
+        line = f.readline()
+        if not line:
+            return []
+        tokens = line.decode('ascii', errors='replace').split()
+        if tokens:
+            return tokens
+
+
+def _dtype(vtk_type, binary):
+    code = VTK_TYPES.get(vtk_type.lower())
+    if code is None:
+        raise ValueError('unsupported legacy VTK data type %r' % vtk_type)
+    return np.dtype(('>' if binary else '=') + code)
+
+
+def _read_array(f, path, binary, vtk_type, count, mmap):
+    #read (or map) count values at the current position and leave f just past them
+    dtype = _dtype(vtk_type, binary)
+    if binary:
+        offset = f.tell()
+        if mmap:
+            values = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+        else:
+            values = np.fromfile(f, dtype=dtype, count=count)
+            if values.size != count:
+                raise ValueError('%s: truncated binary array (%d of %d values)' % (path, values.size, count))
+        f.seek(offset + count*dtype.itemsize)
+        return values, offset
+
+    #bulk parse in C: locate where the section ends and let numpy parse all of it in one call
+    start = f.tell()
+    with _file_map(f.fileno(), 0, access=ACCESS_READ) as data:
+        end = _ascii_end(data, start)
+        values = _parse_ascii(data[start:end], dtype)
+    if values.size == count:
+        f.seek(end)
+        return values, None
+
+    #the values do not fill the section exactly: numpy's stream parser stops after count values
+    f.seek(start)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        try:
+            values = np.fromfile(f, dtype=dtype, count=count, sep=' ')
+        except ValueError:
+            values = np.zeros(0, dtype=dtype)
+    if values.size != count:
+        raise ValueError('%s: truncated ASCII array (%d of %d values)' % (path, values.size, count))
+    return values, None
+
+
+def _ascii_end(data, pos):
+    #offset of the next line starting with a keyword after pos, len(data) at EOF
+    match = _ASCII_KEYWORD.search(data, pos)
+    return match.start() + 1 if match else len(data)
+
+
+def _parse_ascii(text, dtype):
+    #all whitespace separated numbers of text, stopping at the first non-number
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        try:
+            return np.fromstring(text, dtype=dtype, sep=' ')
+        except ValueError:
+            return np.zeros(0, dtype=dtype)
+
+
+def _skip_ascii(f):
+    #move f to the next keyword line (or EOF) without parsing the values in between
+    with _file_map(f.fileno(), 0, access=ACCESS_READ) as data:
+        f.seek(_ascii_end(data, f.tell()))
+
+
+def scan(path, name='VOF', mmap=True):
+    """Parse the header of a legacy VTK file.
+
+    Returns a dict with the dataset type, node coordinates ('x', 'y', 'z'),
+    the ArrayInfo of every data array, and the values of array `name` (None
+    if the file does not contain it). In ASCII files the SCALARS and VECTORS
+    sections of other arrays are skipped, not parsed.
+    """
+    info = {'path': path, 'arrays': [], 'values': None}
+    with open(path, 'rb') as f:
+        f.readline()                                  #vtk DataFile Version x.x
+        f.readline()                                  #title
+        encoding = _next_line(f)
+        if not encoding or encoding[0].upper() not in ('ASCII', 'BINARY'):
+            raise ValueError('%s: not a legacy VTK file' % path)
+        binary = encoding[0].upper() == 'BINARY'
+        info['binary'] = binary
+
+        tokens = _next_line(f)
+        if len(tokens) < 2 or tokens[0] != 'DATASET' or tokens[1] not in ('STRUCTURED_POINTS', 'RECTILINEAR_GRID'):
+            raise ValueError('%s: unsupported dataset %s' % (path, ' '.join(tokens[1:])))
+        info['dataset'] = tokens[1]
+
+        dims = None
+        origin = np.zeros(3)
+        spacing = np.ones(3)
+        coords = [None, None, None]
+        association = None
+        count = 0
+
+        tokens = _next_line(f)
+        while tokens:
+            key = tokens[0].upper()
+            if key == 'DIMENSIONS':
+                dims = [int(t) for t in tokens[1:4]]
+            elif key == 'ORIGIN':
+                origin = np.array(tokens[1:4], dtype=float)
+            elif key in ('SPACING', 'ASPECT_RATIO'):
+                spacing = np.array(tokens[1:4], dtype=float)
+            elif key in ('X_COORDINATES', 'Y_COORDINATES', 'Z_COORDINATES'):
+                values, _ = _read_array(f, path, binary, tokens[2], int(tokens[1]), False)
+                coords['XYZ'.index(key[0])] = values.astype(float)
+            elif key in ('CELL_DATA', 'POINT_DATA'):
+                association = key[:-5]
+                count = int(tokens[1])
+            elif key == 'SCALARS':
+                ncomp = int(tokens[3]) if len(tokens) > 3 else 1
+                pos = f.tell()
+                lookup = _next_line(f)
+                if lookup[:1] != ['LOOKUP_TABLE']:
+                    f.seek(pos)
+                if binary or tokens[1] == name:
+                    values, offset = _read_array(f, path, binary, tokens[2], count*ncomp, mmap)
+                else:
+                    _skip_ascii(f)
+                    values, offset = None, None
+                info['arrays'].append(ArrayInfo(tokens[1], association, tokens[2], count*ncomp, offset))
+                if tokens[1] == name:
+                    info['values'] = values
+            elif key in ('VECTORS', 'NORMALS'):
+                if binary:
+                    values, offset = _read_array(f, path, binary, tokens[2], 3*count, mmap)
+                else:
+                    _skip_ascii(f)
+                    offset = None
+                info['arrays'].append(ArrayInfo(tokens[1], association, tokens[2], 3*count, offset))
+            elif key == 'FIELD':
+                for _ in range(int(tokens[2])):
+                    field = _next_line(f)
+                    size = int(field[1])*int(field[2])
+                    values, offset = _read_array(f, path, binary, field[3], size, mmap)
+                    info['arrays'].append(ArrayInfo(field[0], association, field[3], size, offset))
+                    if field[0] == name:
+                        info['values'] = values
+            else:
+                raise ValueError('%s: unexpected legacy VTK keyword %s' % (path, tokens[0]))
+            tokens = _next_line(f)
+
+    if dims is None:
+        raise ValueError('%s: missing DIMENSIONS' % path)
+    for axis in range(3):
+        if coords[axis] is None:
+            coords[axis] = origin[axis] + spacing[axis]*np.arange(dims[axis])
+        elif coords[axis].size != dims[axis]:
+            raise ValueError('%s: %s_COORDINATES does not match DIMENSIONS' % (path, 'XYZ'[axis]))
+    info['dims'] = dims
+    info['x'], info['y'], info['z'] = coords
+    info['association'] = association
+    return info
+
+
+def read_vof(path, name='VOF', mmap=True):
+    """Read one PARIS subdomain file into a VtkBlock.
+
+    `vof` is indexed [i, j, k] (x fastest in the file, so this is a transposed
+    view of the on-disk order); for CELL_DATA its shape is one less than the
+    node count along each axis. With mmap=True a binary payload stays a
+    read-only np.memmap.
+    """
+    info = scan(path, name=name, mmap=mmap)
+    values = info['values']
+    if values is None:
+        raise ValueError('%s: no array named %r' % (path, name))
+    nx, ny, nz = info['dims']
+    if info['association'] == 'CELL':
+        nx, ny, nz = max(nx - 1, 1), max(ny - 1, 1), max(nz - 1, 1)
+    if values.size != nx*ny*nz:
+        raise ValueError('%s: %s has %d values, expected %d' % (path, name, values.size, nx*ny*nz))
+    vof = values.reshape(nz, ny, nx).transpose()
+    return VtkBlock(path, info['x'], info['y'], info['z'], vof)
+
+
+def to_binary(path, dst=None):
+    """Rewrite an ASCII legacy VTK file as BINARY, with the same arrays and types.
+
+    dst defaults to `path` itself, replaced atomically once the binary copy is
+    complete. Returns False, leaving the file alone, if it is binary already.
+    """
+    dst = path if dst is None else dst
+    with open(path, 'rb') as f:
+        version = f.readline()
+        title = f.readline()
+        encoding = _next_line(f)
+        if encoding[:1] and encoding[0].upper() == 'BINARY':
+            return False
+        if not encoding or encoding[0].upper() != 'ASCII':
+            raise ValueError('%s: not a legacy VTK file' % path)
+
+        with open(dst + '.tmp', 'wb') as out:
+            def line(tokens):
+                out.write((' '.join(tokens) + '\n').encode('ascii'))
+
+            def copy(vtk_type, count):
+                values, _ = _read_array(f, path, False, vtk_type, count, False)
+                out.write(values.astype(_dtype(vtk_type, True)).tobytes())
+                out.write(b'\n')
+
+            try:
+                out.write(version)
+                out.write(title)
+                out.write(b'BINARY\n')
+                count = 0
+                tokens = _next_line(f)
+                while tokens:
+                    line(tokens)
+                    key = tokens[0].upper()
+                    if key in ('X_COORDINATES', 'Y_COORDINATES', 'Z_COORDINATES'):
+                        copy(tokens[2], int(tokens[1]))
+                    elif key in ('CELL_DATA', 'POINT_DATA'):
+                        count = int(tokens[1])
+                    elif key == 'SCALARS':
+                        ncomp = int(tokens[3]) if len(tokens) > 3 else 1
+                        pos = f.tell()
+                        lookup = _next_line(f)
+                        if lookup[:1] == ['LOOKUP_TABLE']:
+                            line(lookup)
+                        else:
+                            f.seek(pos)
+                        copy(tokens[2], count*ncomp)
+                    elif key in ('VECTORS', 'NORMALS'):
+                        copy(tokens[2], 3*count)
+                    elif key == 'FIELD':
+                        for _ in range(int(tokens[2])):
+                            field = _next_line(f)
+                            line(field)
+                            copy(field[3], int(field[1])*int(field[2]))
+                    elif key not in ('DATASET', 'DIMENSIONS', 'ORIGIN', 'SPACING', 'ASPECT_RATIO'):
+                        raise ValueError('%s: unexpected legacy VTK keyword %s' % (path, tokens[0]))
+                    tokens = _next_line(f)
+            except BaseException:
+                out.close()
+                os.remove(dst + '.tmp')
+                raise
+    os.replace(dst + '.tmp', dst)
+    return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rewrite the ASCII legacy VTK files of a directory as binary, in place.')
+    parser.add_argument('vtk_dirs', nargs='+', help='directories of .vtk files')
+    args = parser.parse_args(argv)
+    for vtk_dir in args.vtk_dirs:
+        converted = sum(to_binary(path) for path in sorted(glob.glob(os.path.join(vtk_dir, '*.vtk'))))
+        print('%s: %d files converted to binary' % (vtk_dir, converted))
+
+
+if __name__ == '__main__':
+    main()
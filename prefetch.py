@@ -0,0 +1,66 @@
+"""Read ahead in a background thread while the current item is analysed.
+
+    for task, (grid, report) in prefetch.prefetch(tasks, read, depth=2):
+        analyse(grid)
+
+With depth=2 this is double buffering: timestep t+1 is read and stitched
+while timestep t is labelled. At most `depth` loaded items exist at once
+(the one being analysed included), so memory stays capped however fast the
+disk is; file reads and NumPy copies release the GIL, so a thread suffices.
+"""
+import queue
+import threading
+
+#how often a blocked producer checks whether the consumer went away
+_POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+def prefetch(items, load, depth=2):
+    """Yield (item, load(item)) for every item, in order, loading ahead of the consumer.
+
+    depth <= 1 loads each item only when it is requested. An exception raised
+    by load is re-raised at the item it belongs to. Closing the generator
+    early stops the background thread after the load in progress. `items`
+    is consumed from the background thread.
+    """
+    if depth <= 1:
+        for item in items:
+            yield item, load(item)
+        return
+
+    loaded = queue.Queue()
+    slots = threading.Semaphore(depth)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                while not slots.acquire(timeout=_POLL_SECONDS):
+                    if stop.is_set():
+                        return
+                if stop.is_set():
+                    return
+                loaded.put((item, load(item), None))
+        except Exception as exc:
+            loaded.put((None, None, exc))
+        finally:
+            loaded.put(_DONE)
+
+    producer = threading.Thread(target=produce, name='prefetch', daemon=True)
+    producer.start()
+    try:
+        while True:
+            entry = loaded.get()
+            if entry is _DONE:
+                return
+            item, value, exc = entry
+            if exc is not None:
+                raise exc
+            yield item, value
+            del value, entry
+            slots.release()
+    finally:
+        stop.set()
+        producer.join()
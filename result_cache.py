@@ -0,0 +1,88 @@
+"""Per-(experiment, timestep) cache of the output tables.
+
+Each entry is keyed on a fingerprint that depends on the timestep's input
+files (name, size and mtime, or optionally their contents) and on the
+analysis parameters, so a re-run only recomputes timesteps that are new or changed and rebuilds
+the full output_*.csv from cached fragments.
+"""
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def source_fingerprint(paths, content=False):
+    """Hex key for a set of input files.
+
+    By default files are identified by name, size and mtime; content=True
+    hashes the bytes instead (slow, but survives copies that reset mtimes).
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(os.path.basename(path).encode())
+        if content:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        else:
+            stat = os.stat(path)
+            digest.update(('%d:%d' % (stat.st_size, stat.st_mtime_ns)).encode())
+    return digest.hexdigest()[:16]
+
+
+def fingerprint(paths, params, content=False):
+    """Key '<source>-<params>' for a set of input files and the parameters they are analysed with.
+
+    The source part is source_fingerprint(paths, content), the params part a
+    hash of the JSON of params.
+    """
+    params_key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+    return '%s-%s' % (source_fingerprint(paths, content), params_key)
+
+
+class ResultCache:
+    """Tables of one timestep stored as cache_dir/<experiment>/<tstep>-<key>.npz.
+
+    A timestep keeps one entry per set of analysis parameters, so runs with
+    different estimators or thresholds do not evict each other; entries are
+    only dropped once the timestep's input files change.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, experiment, tstep, key):
+        return os.path.join(self.cache_dir, experiment, '%05d-%s.npz' % (tstep, key))
+
+    def has(self, experiment, tstep, key):
+        return os.path.exists(self._path(experiment, tstep, key))
+
+    def get(self, experiment, tstep, key, exp=None):
+        """{name: table} stored for this key, or None.
+
+        The exp# column is overwritten with `exp` when given, since an
+        experiment's index changes when others are added to the sweep.
+        """
+        path = self._path(experiment, tstep, key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as stored:
+            tables = {name: stored[name] for name in stored.files}
+        if exp is not None:
+            for table in tables.values():
+                table[:, 0] = exp
+        return tables
+
+    def put(self, experiment, tstep, key, tables):
+        #store {name: table}, removing entries of this timestep computed from other versions of its files
+        path = self._path(experiment, tstep, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        current = os.path.join(self.cache_dir, experiment, '%05d-%s-' % (tstep, key.split('-')[0]))
+        for stale in glob.glob(self._path(experiment, tstep, '*')):
+            if not stale.startswith(current):
+                os.remove(stale)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **tables)
+        os.replace(path + '.tmp', path)
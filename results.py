@@ -0,0 +1,91 @@
+"""Append-only writer for the per-blob output tables.
+
+Every table (one timestep's rows) is appended and flushed to the CSV as it
+arrives (same format as np.savetxt with the output_*.csv header), so a crash
+loses nothing already appended. Optionally the rows also go to a directory
+of numbered .npy chunks that reload much faster than text; those are
+batched so a long run does not leave one tiny file per timestep, and only
+the unflushed batch is held in memory.
+"""
+import glob
+import os
+import time
+
+import numpy as np
+
+
+class ResultWriter:
+    """Append tables to `csv_path` (and `chunk_dir`/chunk_NNNNNN.npy) as they arrive.
+
+    Use as a context manager or call close(). The CSV is flushed on every
+    append; a .npy chunk is written once `batch_rows` rows are pending or
+    `batch_seconds` have passed since the last one.
+    """
+
+    def __init__(self, csv_path, header, chunk_dir=None, batch_rows=4096, batch_seconds=10.0):
+        self.csv_path = csv_path
+        self.chunk_dir = chunk_dir
+        self.batch_rows = batch_rows
+        self.batch_seconds = batch_seconds
+        self.rows = 0
+        self._pending = []
+        self._pending_rows = 0
+        self._chunks = 0
+        self._last_chunk = time.monotonic()
+        self._csv = open(csv_path, 'w')
+        self._csv.write('# ' + header + '\n')
+        self._csv.flush()
+        if chunk_dir is not None:
+            os.makedirs(chunk_dir, exist_ok=True)
+            for old in glob.glob(os.path.join(chunk_dir, 'chunk_*.npy')):
+                os.remove(old)
+
+    def append(self, table):
+        #write the rows of one (nrows, ncols) table to the CSV and queue them for the next .npy chunk
+        table = np.atleast_2d(table)
+        if table.shape[0] == 0:
+            return
+        np.savetxt(self._csv, table, delimiter=',')
+        self._csv.flush()
+        self.rows += table.shape[0]
+        if self.chunk_dir is None:
+            return
+        self._pending.append(table)
+        self._pending_rows += table.shape[0]
+        if self._pending_rows >= self.batch_rows or time.monotonic() - self._last_chunk >= self.batch_seconds:
+            self.flush()
+
+    def flush(self):
+        #write the pending rows as the next .npy chunk
+        self._last_chunk = time.monotonic()
+        if not self._pending:
+            return
+        batch = np.vstack(self._pending)
+        self._pending = []
+        self._pending_rows = 0
+        #write then rename so a half-written chunk never looks complete
+        path = os.path.join(self.chunk_dir, 'chunk_%06d.npy' % self._chunks)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, batch)
+        os.replace(path + '.tmp', path)
+        self._chunks += 1
+
+    def close(self):
+        if self._csv.closed:
+            return
+        self.flush()
+        self._csv.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_chunks(chunk_dir, ncols=13):
+    #all rows written to a chunk directory, in write order
+    paths = sorted(glob.glob(os.path.join(chunk_dir, 'chunk_*.npy')))
+    if not paths:
+        return np.zeros((0, ncols))
+    return np.vstack([np.load(path) for path in paths])
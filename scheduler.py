@@ -0,0 +1,71 @@
+"""Run whole experiments of a parameter sweep concurrently, biggest first.
+
+Experiments are surveyed up front (file catalogs and sizes, no data read),
+then started largest first in a process pool. A job only starts while the
+estimated memory of everything running fits the budget, so a few huge
+experiments cannot OOM the node while the small ones backfill around them.
+"""
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import catalog
+
+#a timestep in memory costs roughly this many times its file size: the
+#float64 global array, the threshold mask, provisional and final labels
+MEMORY_PER_FILE_BYTE = 8
+
+#catalog is the experiment's catalog.Catalog, cost its total bytes on disk and
+#memory the estimated peak of one timestep
+Experiment = namedtuple('Experiment', ['index', 'name', 'vtk_dir', 'catalog', 'cost', 'memory'])
+
+
+def survey(top_dir, exps):
+    """Experiment records for the experiment directories `exps` of `top_dir`, from their catalogs."""
+    experiments = []
+    for index, name in enumerate(exps):
+        vtk_dir = catalog.experiment_vtk_dir(top_dir, name)
+        vof_catalog = catalog.load(vtk_dir)
+        if not vof_catalog.complete:
+            print(catalog.format_report(vof_catalog))
+        tstep_bytes = [vof_catalog.tstep_bytes(tstep) for tstep in vof_catalog.timesteps]
+        cost = sum(tstep_bytes)
+        memory = MEMORY_PER_FILE_BYTE*max(tstep_bytes, default=0)
+        experiments.append(Experiment(index, name, vtk_dir, vof_catalog, cost, memory))
+    return experiments
+
+
+def run_largest_first(jobs, func, workers=1, memory_budget=None):
+    """Call func(job) for every job in a process pool and yield the results in job order.
+
+    jobs need `cost` and `memory` attributes. Pending jobs are started in
+    decreasing cost order, skipping any whose memory would push the running
+    total over memory_budget (bytes, None for no limit); one job always runs
+    even if it alone exceeds the budget. A result is yielded as soon as its
+    job and all earlier ones are done, so it can be written while later jobs
+    still run.
+    """
+    pending = sorted(range(len(jobs)), key=lambda n: -jobs[n].cost)
+    #finished results not yet yielded, by job index
+    results = {}
+    next_job = 0
+    running = {}
+    in_use = 0
+    with ProcessPoolExecutor(max_workers=max(workers, 1)) as pool:
+        while pending or running:
+            while pending and len(running) < max(workers, 1):
+                fits = [n for n in pending
+                        if not running or memory_budget is None or in_use + jobs[n].memory <= memory_budget]
+                if not fits:
+                    break
+                n = fits[0]
+                pending.remove(n)
+                running[pool.submit(func, jobs[n])] = n
+                in_use += jobs[n].memory
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                n = running.pop(future)
+                in_use -= jobs[n].memory
+                results[n] = future.result()
+            while next_job in results:
+                yield results.pop(next_job)
+                next_job += 1
@@ -0,0 +1,164 @@
+"""Per-blob moments computed where the data lives, handed over as a small vtkTable.
+
+reduce_dataset runs inside a ProgrammableFilter on the (pv)server, on the
+output of the Connectivity filter (cell VOF, point VOF and RegionId): the
+cell centres, volumes and corners are taken from the grid there and reduced
+with moment_kernels, and only one row of partial moments per blob comes
+back through servermanager.Fetch instead of the cell and corner geometry.
+With a parallel pvserver every rank reduces its own piece and gather_table
+sends the rows to rank 0, whose table is the one fetched; the rows of a blob
+split between ranks are combined with the parallel-axis theorem by
+table_moments on the client. Needs numpy (and VTK) in the server's
+python, and this directory on its path (paraview_backend.reduction_filter
+adds it).
+"""
+import numpy as np
+
+try:
+    from vtkmodules.numpy_interface import dataset_adapter as dsa
+    from vtkmodules.util import numpy_support
+    from vtkmodules.vtkCommonDataModel import vtkTable
+    from vtkmodules.vtkParallelCore import vtkMultiProcessController
+except ImportError:
+    from vtk.numpy_interface import dataset_adapter as dsa
+    from vtk.util import numpy_support
+    from vtk import vtkMultiProcessController, vtkTable
+
+import blob_moments
+import moment_kernels
+import subdomains
+
+#per estimator columns of the table, as in the output CSVs
+COLUMNS = blob_moments.HEADER.split(',')[3:]
+
+#message tag of the tables sent to rank 0
+GATHER_TAG = 8207
+
+
+def corner_ids(dataset):
+    #(N, 8) point ids of the cells of a hexahedron/voxel-only unstructured grid
+    cells = dataset.GetCells()
+    if hasattr(cells, 'GetConnectivityArray'):
+        ids = numpy_support.vtk_to_numpy(cells.GetConnectivityArray())
+        offsets = numpy_support.vtk_to_numpy(cells.GetOffsetsArray())
+        if not np.all(np.diff(offsets) == 8):
+            raise ValueError('expected only 8-point cells in the labelled grid')
+        return ids.reshape(-1, 8)
+    #VTK < 9 stores (npts, id0, ..., id7) per cell
+    legacy = numpy_support.vtk_to_numpy(cells.GetData())
+    if legacy.size % 9 or not np.all(legacy[::9] == 8):
+        raise ValueError('expected only 8-point cells in the labelled grid')
+    return legacy.reshape(-1, 9)[:, 1:]
+
+
+def dataset_cells(dataset, with_corners=True):
+    """Per-cell arrays of a labelled grid, the tuple paraview_backend.fetch_cells returns.
+
+    Cell centres are the mean of the 8 corners and volumes the product of
+    their extents, exact for the axis-aligned cells PARIS writes. Ghost cells
+    of a distributed dataset are left out.
+    """
+    data = dsa.WrapDataObject(dataset)
+    if data.GetNumberOfCells() == 0:
+        cells = (np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0), np.zeros((0, 3)))
+        return cells + (np.zeros((0, 8, 3)), np.zeros((0, 8))) if with_corners else cells
+
+    ids = corner_ids(dataset)
+    keep = slice(None)
+    if 'vtkGhostType' in data.CellData.keys():
+        keep = np.asarray(data.CellData['vtkGhostType']) == 0
+        ids = ids[keep]
+    #gathered in the data's own dtype, the kernels take float32 corners as they are
+    corner_coords = np.asarray(data.Points)[ids]
+    cells = (np.asarray(data.CellData['RegionId']).astype(np.int64)[keep],
+             np.asarray(data.CellData['VOF'], dtype=np.float64)[keep],
+             np.prod(corner_coords.max(axis=1).astype(np.float64) - corner_coords.min(axis=1), axis=1),
+             corner_coords.mean(axis=1, dtype=np.float64))
+    if not with_corners:
+        return cells
+    return cells + (corner_coords, np.asarray(data.PointData['VOF'])[ids])
+
+
+def partial_moments(cells, estimators=blob_moments.ESTIMATORS, kernels='auto'):
+    """(blob ids present, {estimator: (vol, com, inertia)} of each) from per-cell arrays.
+
+    Blob ids are the global RegionIds; blobs with no cells here are left out.
+    The arithmetic inertia is about the geometric COM, as subdomains.combine expects.
+    """
+    present, local = np.unique(cells[0], return_inverse=True)
+    return present, moment_kernels.cell_moments((local,) + tuple(cells[1:]), present.size, estimators, kernels)
+
+
+def reduce_dataset(dataset, estimators=blob_moments.ESTIMATORS, kernels='auto'):
+    """vtkTable with a 'blob' column and '<estimator>_<column>' partial moments, one row per blob in dataset."""
+    needed = subdomains._needed(estimators)
+    cells = dataset_cells(dataset, blob_moments.needs_corners(needed))
+    present, moments = partial_moments(cells, needed, kernels)
+    columns = [('blob', present)]
+    for name in needed:
+        values = np.column_stack(moments[name])
+        columns += [('%s_%s' % (name, column), values[:, n]) for n, column in enumerate(COLUMNS)]
+    return _table(columns)
+
+
+def _table(columns):
+    #vtkTable of (name, values) columns
+    table = vtkTable()
+    for column, values in columns:
+        array = numpy_support.numpy_to_vtk(np.ascontiguousarray(values), deep=1)
+        array.SetName(column)
+        table.AddColumn(array)
+    return table
+
+
+def _columns(table):
+    #{name: values} of a vtkTable
+    return {table.GetColumnName(n): numpy_support.vtk_to_numpy(table.GetColumn(n))
+            for n in range(table.GetNumberOfColumns())}
+
+
+def gather_table(table, controller=None):
+    """The rows of every server rank's reduce_dataset table appended on rank 0.
+
+    The other ranks send theirs and are left with an empty table, so
+    fetching rank 0's output brings every row whatever the ParaView
+    version's reduction helpers do with tables. Serially this is a no-op.
+    controller defaults to the global one (MPI under a parallel pvserver).
+    """
+    if controller is None:
+        controller = vtkMultiProcessController.GetGlobalController()
+    if controller is None or controller.GetNumberOfProcesses() < 2:
+        return table
+    if controller.GetLocalProcessId() != 0:
+        controller.Send(table, 0, GATHER_TAG)
+        return vtkTable()
+    parts = [_columns(table)]
+    for rank in range(1, controller.GetNumberOfProcesses()):
+        received = vtkTable()
+        controller.Receive(received, rank, GATHER_TAG)
+        parts.append(_columns(received))
+    return _table([(name, np.concatenate([part[name] for part in parts])) for name in parts[0]])
+
+
+def combine_rows(blob, columns, estimators=blob_moments.ESTIMATORS):
+    """(num_blobs, {estimator: (vol, com, inertia)}) from rows of partial moments.
+
+    blob holds the blob id of every row and columns the '<estimator>_<column>'
+    arrays; several rows of one blob (from several server ranks) are combined.
+    """
+    if blob.size == 0:
+        empty = (np.zeros(0), np.zeros((0, 3)), np.zeros((0, 6)))
+        return 0, {name: empty for name in estimators}
+    num_blobs = int(blob.max()) + 1
+    parts = {}
+    for name in subdomains._needed(estimators):
+        values = np.column_stack([columns['%s_%s' % (name, column)] for column in COLUMNS])
+        parts[name] = (values[:, 0], values[:, 1:4], values[:, 4:])
+    return num_blobs, subdomains.combine(blob, num_blobs, parts, estimators)
+
+
+def table_moments(table, estimators=blob_moments.ESTIMATORS):
+    #combine_rows of a fetched reduce_dataset (or gather_table) table
+    columns = _columns(table)
+    blob = columns.pop('blob', np.zeros(0)).astype(np.int64)
+    return combine_rows(blob, columns, estimators)
@@ -0,0 +1,218 @@
+"""Out-of-core analysis of one timestep, streamed through memory in z slabs.
+
+The merged grid of a 1024^3 run (8 GB as float64, plus node VOF, labels and
+per-cell temporaries) does not fit on an analysis node. Here only one slab
+of whole x-y layers is held at a time: it is read from the memory-mapped
+subdomain files (or the experiment's vof_store), with a one-cell halo below
+and above for the node-interpolated corner VOF, labelled on its own and
+reduced to per-blob partial moments. The slab's bottom layer is joined to
+the top layer of the previous one through an equivalence table (the labels
+of that single layer), and the partial moments are folded into the running
+per-blob totals with the parallel-axis theorem after every slab. Memory is
+the slab plus one record per blob, whatever the number of z layers; the
+slab thickness follows from a memory budget.
+
+    moments = slabs.analyze(reader, lower, upper, connectivity, periodic, estimators, memory_budget=2e9)
+
+Blob numbers are those of labeling.label on the merged grid and the moments
+agree with the merged reduction to rounding.
+"""
+import os
+import warnings
+from collections import namedtuple
+
+import numpy as np
+
+import assemble
+import blob_moments
+import corners
+import labeling
+import moment_kernels
+import subdomains
+import vof_store
+
+#approximate peak bytes per cell of a slab: VOF with halo, node VOF, mask, provisional and final labels
+GRID_BYTES_PER_CELL = 48
+
+#and peak bytes per liquid cell of the NumPy reduction: 'center' alone (indices, centres, volumes, offsets
+#from the COM, second moments) and with corners (also corner coordinates and VOF, logarithms, distances,
+#cuboids); the Numba kernels keep nothing per cell
+CENTER_BYTES_PER_CELL = 256
+CORNER_BYTES_PER_CELL = 1024
+
+#the NumPy reduction runs over chunks of cells within this fraction of the memory budget
+REDUCTION_SHARE = 0.25
+
+#where slabs come from: read(k0, k1) returns the float64 VOF of cells k0 <= k < k1, x, y, z the node coordinates
+SlabReader = namedtuple('SlabReader', ['read', 'x', 'y', 'z', 'report'])
+
+
+def file_reader(paths, read_threads=1):
+    """SlabReader over the memory-mapped subdomain files of one timestep.
+
+    Binary payloads are only touched for the layers read; ASCII files are
+    parsed again for every slab (convert them with paris_vtk.py first).
+    Raises ValueError if blocks overlap.
+    """
+    paths = list(paths)
+    x, y, z, extents, report = subdomains.layout(paths, read_threads)
+    shape = (x.size - 1, y.size - 1, z.size - 1)
+
+    def read(k0, k1):
+        sources = [(path, extent) for path, extent in zip(paths, extents) if extent[4] < k1 and extent[5] > k0]
+        return subdomains.read_region((0, shape[0], 0, shape[1], k0, k1), sources)
+
+    return SlabReader(read, x, y, z, report)
+
+
+def store_reader(store, tstep):
+    #SlabReader over one timestep of an open vof_store, decompressing only the chunks a slab needs
+    def read(k0, k1):
+        return np.asarray(store.read(tstep, k0, k1).vof, dtype=np.float64)
+
+    return SlabReader(read, store.x, store.y, store.z, assemble.AssemblyReport([], 0, []))
+
+
+def reduction_cells(memory_budget, estimators=blob_moments.ESTIMATORS, kernels='auto'):
+    #cells per chunk of the NumPy reduction, None for the Numba kernels, which keep nothing per cell
+    if moment_kernels.use_numba(kernels):
+        return None
+    per_cell = CORNER_BYTES_PER_CELL if blob_moments.needs_corners(estimators) else CENTER_BYTES_PER_CELL
+    return max(1, int(REDUCTION_SHARE*memory_budget // per_cell))
+
+
+def slab_thickness(shape, memory_budget, estimators=blob_moments.ESTIMATORS, kernels='auto'):
+    """z layers per slab so that one slab (plus its two halo layers) stays within memory_budget bytes.
+
+    The share of the NumPy reduction's chunks (reduction_cells) is set
+    aside first. A budget too small for three layers gets one-layer slabs
+    and a warning.
+    """
+    budget = memory_budget
+    if reduction_cells(memory_budget, estimators, kernels) is not None:
+        budget -= REDUCTION_SHARE*memory_budget
+    layers = int(budget // (GRID_BYTES_PER_CELL*shape[0]*shape[1])) - 2
+    if layers < 1:
+        warnings.warn('a memory budget of %.3g GB does not fit three %dx%d layers, using one-layer slabs'
+                      % (memory_budget/1e9, *shape[:2]), RuntimeWarning)
+        return 1
+    return layers
+
+
+def chunked_moments(grid, labels, num_blobs, estimators, node_values, max_cells):
+    """NumPy grid_moments over chunks of at most max_cells cells (whole x rows, at least one).
+
+    Each chunk is reduced over the blobs it holds and the chunks are combined
+    with the parallel-axis theorem, so the per-cell temporaries never exceed
+    one chunk. node_values is None when no estimator needs corners.
+    """
+    nx, ny, nz = labels.shape
+    rows = max(1, max_cells // nx)
+    if rows >= ny:
+        layers = rows // ny
+        chunks = [(0, ny, k, min(k + layers, nz)) for k in range(0, nz, layers)]
+    else:
+        chunks = [(j, min(j + rows, ny), k, k + 1) for k in range(nz) for j in range(0, ny, rows)]
+
+    blobs = []
+    parts = []
+    for j0, j1, k0, k1 in chunks:
+        chunk = labels[:, j0:j1, k0:k1]
+        present, local = np.unique(chunk, return_inverse=True)
+        if present[-1] < 0:
+            continue
+        local = local.reshape(chunk.shape) - (present[0] < 0)
+        present = present[present >= 0]
+        sub = assemble.VofGrid(grid.x, grid.y[j0:j1 + 1], grid.z[k0:k1 + 1], grid.vof[:, j0:j1, k0:k1])
+        sub_nodes = None if node_values is None else node_values[:, j0:j1 + 1, k0:k1 + 1]
+        parts.append(moment_kernels.grid_moments(sub, local, present.size, estimators, 'numpy', sub_nodes))
+        blobs.append(present)
+    if not parts:
+        empty = (np.zeros(0), np.zeros((0, 3)), np.zeros((0, 6)))
+        return {name: empty for name in estimators}
+    return subdomains.combine(np.concatenate(blobs), num_blobs, subdomains.concat_parts(parts), estimators)
+
+
+def _relabel(layer, blob):
+    #a layer of provisional ids mapped to blobs, indexing only labelled cells (blob is empty until liquid is seen)
+    out = np.full_like(layer, -1)
+    liquid = layer >= 0
+    out[liquid] = blob[layer[liquid]]
+    return out
+
+
+def analyze(reader, lower=1.0e-10, upper=1.0, connectivity=26, periodic=(False, False, False),
+            estimators=blob_moments.ESTIMATORS, kernels='auto', memory_budget=1e9, slab=None):
+    """{estimator: (vol, com, inertia)} of every blob of the grid `reader` streams, one z slab at a time.
+
+    slab is the number of z layers per slab, by default the most
+    memory_budget bytes allow (slab_thickness). The NumPy reduction runs in
+    chunks of reduction_cells cells.
+    """
+    x, y, z = reader.x, reader.y, reader.z
+    shape = (x.size - 1, y.size - 1, z.size - 1)
+    needed = subdomains._needed(estimators)
+    if slab is None:
+        slab = slab_thickness(shape, memory_budget, needed, kernels)
+    max_cells = reduction_cells(memory_budget, needed, kernels)
+
+    first = np.zeros(0, dtype=np.int64)
+    totals = None
+    top = bottom = None
+    for k0 in range(0, shape[2], slab):
+        k1 = min(k0 + slab, shape[2])
+        h0, h1 = max(k0 - 1, 0), min(k1 + 1, shape[2])
+        halo = reader.read(h0, h1)
+        own = slice(k0 - h0, k1 - h0)
+        vof = halo[:, :, own]
+        labels, counts = labeling.label(vof, lower, upper, connectivity, (periodic[0], periodic[1], False))
+        node_values = None
+        if blob_moments.needs_corners(needed):
+            node_values = corners.cell_to_point(halo)[:, :, own.start:own.stop + 1]
+        grid = assemble.VofGrid(x, y, z[k0:k1 + 1], vof)
+        if max_cells is None:
+            moments = moment_kernels.grid_moments(grid, labels, counts.size, needed, kernels, node_values)
+        else:
+            moments = chunked_moments(grid, labels, counts.size, needed, node_values, max_cells)
+        del halo, vof, grid, node_values
+
+        #this slab's blobs follow the running ones; its bottom layer meets the previous slab's top layer
+        offset = first.size
+        low = np.where(labels[:, :, :1] >= 0, labels[:, :, :1] + offset, -1)
+        high = np.where(labels[:, :, -1:] >= 0, labels[:, :, -1:] + offset, -1)
+        if top is None:
+            u, v = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+            bottom = low
+        else:
+            u, v = subdomains.plane_pairs(top, low, 2, connectivity, periodic)
+        first = np.concatenate((first, subdomains.first_cells(labels, (0, 0, k0), shape)))
+        parts = moments if totals is None else subdomains.concat_parts((totals, moments))
+        blob, first, totals = subdomains.stitch(first, parts, u, v, needed)
+        top = _relabel(high, blob)
+        bottom = _relabel(bottom, blob)
+
+    if totals is None:
+        empty = (np.zeros(0), np.zeros((0, 3)), np.zeros((0, 6)))
+        return {name: empty for name in estimators}
+    if periodic[2] and shape[2] >= 2:
+        u, v = subdomains.plane_pairs(top, bottom, 2, connectivity, periodic)
+        totals = subdomains.stitch(first, totals, u, v, needed)[2]
+    return {name: totals[name] for name in estimators}
+
+
+def open_reader(vtk_dir, tstep, paths, use_store=False, read_threads=1):
+    """SlabReader for one timestep and the store to close afterwards (or None).
+
+    With use_store the experiment's vof_store is read where it holds this
+    timestep converted from the current files, otherwise the files are.
+    """
+    if use_store:
+        for hdf5 in (False, True):
+            path = vof_store.default_path(vtk_dir, hdf5)
+            if not os.path.exists(path) or (hdf5 and vof_store.h5py is None):
+                continue
+            store = vof_store.open_store(path)
+            if store.keys.get(tstep) == vof_store.source_key(paths):
+                return store_reader(store, tstep), store
+            store.close()
+    return file_reader(paths, read_threads), None
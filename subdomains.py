@@ -0,0 +1,276 @@
+"""Label and reduce every subdomain file of a timestep on its own, then stitch.
+
+PARIS already writes each timestep as num_proc blocks. Instead of merging
+them into the global grid first, every block is labelled and reduced to
+per-blob partial moments in a process of its own, reading only its file and
+a one-cell halo from its neighbours (the corner VOF of boundary cells is
+interpolated from cells on both sides). Only the six face layers of each
+block's labels come back: blobs continuing across block boundaries (and
+periodic faces) are joined with labeling.components over one pair of
+boundary planes at a time, and their partial volumes, COMs and inertia
+tensors are combined with the parallel-axis theorem. No process ever holds
+more than one block plus its halo.
+
+Blob numbering is that of labeling.label on the merged grid and the moments
+agree with the merged reduction to rounding.
+"""
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import assemble
+import blob_moments
+import corners
+import labeling
+import moment_kernels
+import paris_vtk
+
+#process pool reused across timesteps: [workers, pool]
+_POOL = [None, None]
+
+
+def _executor(workers):
+    if _POOL[0] != workers:
+        if _POOL[1] is not None:
+            _POOL[1].shutdown()
+        _POOL[:] = [workers, ProcessPoolExecutor(max_workers=workers)]
+    return _POOL[1]
+
+
+def _layout(path):
+    #VtkBlock of one file's node coordinates, its values replaced by a zero-size stand-in of the cell shape
+    info = paris_vtk.scan(path, name=None)
+    cells = tuple(max(n - 1, 1) for n in info['dims'])
+    return paris_vtk.VtkBlock(path, info['x'], info['y'], info['z'], np.broadcast_to(np.float64(0), cells))
+
+
+def _needed(estimators):
+    #partial moments to compute; combining the arithmetic inertia needs the geometric COM of every part
+    return tuple(name for name in blob_moments.ESTIMATORS
+                 if name in estimators or (name == 'geometric' and 'arithmetic' in estimators))
+
+
+def halo_regions(extents, shape):
+    """Every block's extent grown by one cell (clipped to the grid) and the blocks that region touches."""
+    lo = np.maximum(extents[:, 0::2] - 1, 0)
+    hi = np.minimum(extents[:, 1::2] + 1, shape)
+    regions = np.empty_like(extents)
+    regions[:, 0::2] = lo
+    regions[:, 1::2] = hi
+    touch = np.all(np.maximum(lo[:, None], extents[None, :, 0::2]) < np.minimum(hi[:, None], extents[None, :, 1::2]),
+                   axis=2)
+    return regions, [np.flatnonzero(row) for row in touch]
+
+
+def read_region(region, sources):
+    """VOF of the cells region = (i0, i1, j0, j1, k0, k1) from the (path, extent) blocks covering it.
+
+    Cells no block covers are 0, as in assemble.assemble.
+    """
+    lo, hi = np.asarray(region[0::2]), np.asarray(region[1::2])
+    out = np.zeros(hi - lo)
+    for path, extent in sources:
+        origin = np.asarray(extent[0::2])
+        start, stop = np.maximum(lo, origin), np.minimum(hi, extent[1::2])
+        if np.any(start >= stop):
+            continue
+        vof = paris_vtk.read_vof(path).vof
+        out[tuple(map(slice, start - lo, stop - lo))] = vof[tuple(map(slice, start - origin, stop - origin))]
+    return out
+
+
+def label_block(extent, region, sources, x, y, z, shape, lower=1.0e-10, upper=1.0, connectivity=26,
+                estimators=blob_moments.ESTIMATORS, kernels='auto'):
+    """Blobs of one block as (first, moments, faces).
+
+    extent is the block's (i0, i1, j0, j1, k0, k1) in the grid of `shape`
+    cells, region/sources its halo from halo_regions and x, y, z its node
+    coordinates. first holds the global x-fastest index of the first cell of
+    every local blob, moments is {estimator: (vol, com, inertia)} of the
+    local blobs and faces[axis] the (low, high) boundary layers of the local
+    labels.
+    """
+    halo = read_region(region, sources)
+    own = tuple(slice(e0 - r0, e1 - r0) for e0, e1, r0 in zip(extent[0::2], extent[1::2], region[0::2]))
+    vof = halo[own]
+    labels, counts = labeling.label(vof, lower, upper, connectivity)
+
+    node_values = None
+    if blob_moments.needs_corners(estimators):
+        node_values = corners.cell_to_point(halo)[tuple(slice(s.start, s.stop + 1) for s in own)]
+    grid = assemble.VofGrid(x, y, z, vof)
+    moments = moment_kernels.grid_moments(grid, labels, counts.size, estimators, kernels, node_values)
+
+    faces = [(labels.take([0], axis=axis), labels.take([-1], axis=axis)) for axis in range(3)]
+    return first_cells(labels, extent[0::2], shape), moments, faces
+
+
+def first_cells(labels, origin, shape):
+    """Global x-fastest index of the first cell of every blob of a block at cell `origin` of a `shape` grid.
+
+    Labels come from labeling.label, so blob n's first cell is the n-th new
+    label in x-fastest order.
+    """
+    flat = labels.ravel(order='F')
+    liquid = np.flatnonzero(flat >= 0)
+    _, first = np.unique(flat[liquid], return_index=True)
+    i, j, k = np.unravel_index(liquid[first], labels.shape, order='F')
+    return (i + origin[0]) + shape[0]*((j + origin[1]) + shape[1]*(k + origin[2]))
+
+
+def _label_job(job, options):
+    return label_block(*job, **options)
+
+
+def plane_pairs(low, high, axis, connectivity=26, periodic=(False, False, False)):
+    """Id pairs of cells touching across a boundary between the layers low and high (size 1 along axis)."""
+    pairs_u = []
+    pairs_v = []
+    for d in labeling.neighbour_offsets(connectivity, half=False):
+        if d[axis] != 1:
+            continue
+        lateral = tuple(0 if a == axis else d[a] for a in range(3))
+        u, v = labeling.neighbour_pairs(low, high, lateral, wrap=periodic)
+        pairs_u.append(u)
+        pairs_v.append(v)
+    return np.concatenate(pairs_u), np.concatenate(pairs_v)
+
+
+def boundary_pairs(extents, faces, offsets, shape, connectivity=26, periodic=(False, False, False)):
+    """Global provisional ids of blob pairs touching across block boundaries.
+
+    faces[n] are the face layers label_block returned for block n and
+    offsets[n] the global id of its first blob. Planes are assembled one
+    boundary at a time, from the faces of the blocks ending and starting
+    there, so diagonal contacts between blocks meeting at an edge or corner
+    are found as well.
+    """
+    pairs_u = []
+    pairs_v = []
+    for axis in range(3):
+        n = shape[axis]
+        ends = extents[:, 2*axis + 1]
+        starts = extents[:, 2*axis]
+        planes = sorted(set(ends.tolist()) & set(starts.tolist()))
+        if periodic[axis] and n >= 2:
+            planes.append(0)
+        plane_shape = list(shape)
+        plane_shape[axis] = 1
+        for plane in planes:
+            low = np.full(plane_shape, -1, dtype=np.int64)
+            high = np.full(plane_shape, -1, dtype=np.int64)
+            for side, layer, blocks in ((low, 1, ends == (plane or n)), (high, 0, starts == plane)):
+                for m in np.flatnonzero(blocks):
+                    span = [slice(extents[m, 2*a], extents[m, 2*a + 1]) for a in range(3)]
+                    span[axis] = slice(0, 1)
+                    face = faces[m][axis][layer]
+                    side[tuple(span)] = np.where(face >= 0, face + offsets[m], -1)
+            u, v = plane_pairs(low, high, axis, connectivity, periodic)
+            pairs_u.append(u)
+            pairs_v.append(v)
+    if not pairs_u:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(pairs_u), np.concatenate(pairs_v)
+
+
+def combine(blob, num_blobs, parts, estimators=blob_moments.ESTIMATORS):
+    """{estimator: (vol, com, inertia)} of whole blobs from the moments of their parts.
+
+    blob maps every part to its blob and parts is {estimator: (vol, com,
+    inertia)} per part, each inertia about the part's own COM (the
+    arithmetic one about the part's geometric COM). Every part's inertia is
+    moved to the blob's reference point with the parallel-axis theorem.
+    """
+    vol = None
+    coms = {}
+    for name, (part_vol, part_com, _) in parts.items():
+        vol = blob_moments.segment_sum(blob, part_vol, num_blobs)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            coms[name] = blob_moments.segment_sum(blob, part_vol[:, None]*part_com, num_blobs)/vol[:, None]
+
+    results = {}
+    for name in estimators:
+        part_vol, part_com, part_inertia = parts[name]
+        reference = 'geometric' if name == 'arithmetic' else name
+        inertia = (part_inertia - blob_moments.parallel_axis(part_vol, part_com - parts[reference][1])
+                   + blob_moments.parallel_axis(part_vol, part_com - coms[reference][blob]))
+        results[name] = (vol, coms[name], blob_moments.segment_sum(blob, inertia, num_blobs))
+    return results
+
+
+def stitch(first, parts, u, v, estimators=blob_moments.ESTIMATORS):
+    """Join parts touching along the id pairs (u, v) into blobs.
+
+    first holds the first cell of every part and parts its moments as in
+    combine. Returns (blob, first, moments): the blob of every part, the
+    first cell and the combined moments of every blob, blobs numbered by
+    their first cell in x-fastest order as labeling.finalize does.
+    """
+    root = labeling.components(first.size, u, v)
+    roots, part_root = np.unique(root, return_inverse=True)
+    blob_first = np.full(roots.size, np.iinfo(np.int64).max)
+    np.minimum.at(blob_first, part_root, first.astype(np.int64))
+    order = np.argsort(blob_first)
+    rank = np.empty(roots.size, dtype=np.int64)
+    rank[order] = np.arange(roots.size)
+    blob = rank[part_root]
+    return blob, blob_first[order], combine(blob, roots.size, parts, estimators)
+
+
+def concat_parts(parts):
+    #one {estimator: (vol, com, inertia)} from a sequence of them
+    return {name: tuple(np.concatenate([part[name][n] for part in parts]) for n in range(3)) for name in parts[0]}
+
+
+def layout(paths, read_threads=1):
+    """(x, y, z, extents, report) of the blocks of one timestep, from their headers alone.
+
+    Raises ValueError if blocks overlap, which needs the merged grid.
+    """
+    paths = list(paths)
+    x, y, z, extents = assemble.block_extents(assemble._map(_layout, paths, read_threads))
+    overlaps = assemble._overlaps(extents)
+    if overlaps:
+        raise ValueError('%s: blocks overlap, label the merged grid instead' % paths[0])
+    shape = (x.size - 1, y.size - 1, z.size - 1)
+    gaps = int(np.prod(shape) - np.prod(extents[:, 1::2] - extents[:, 0::2], axis=1).sum())
+    report = assemble.AssemblyReport([tuple(int(v) for v in e) for e in extents], gaps, overlaps)
+    return x, y, z, extents, report
+
+
+def block_jobs(paths, x, y, z, extents):
+    #label_block arguments of every block, in block order
+    shape = np.array([x.size - 1, y.size - 1, z.size - 1])
+    regions, touching = halo_regions(extents, shape)
+    return [(extents[n], regions[n], [(paths[m], extents[m]) for m in touching[n]],
+             x[extents[n, 0]:extents[n, 1] + 1], y[extents[n, 2]:extents[n, 3] + 1], z[extents[n, 4]:extents[n, 5] + 1],
+             shape) for n in range(len(paths))]
+
+
+def stitch_blocks(blocks, extents, shape, connectivity=26, periodic=(False, False, False),
+                  estimators=blob_moments.ESTIMATORS):
+    """{estimator: (vol, com, inertia)} of the whole grid from the label_block results of all blocks, in order."""
+    #every local blob gets a global provisional id, joined across the block boundaries
+    firsts, parts, faces = zip(*blocks)
+    offsets = np.concatenate(([0], np.cumsum([first.size for first in firsts])))
+    u, v = boundary_pairs(extents, faces, offsets, shape, connectivity, periodic)
+    return stitch(np.concatenate(firsts), concat_parts(parts), u, v, estimators)[2]
+
+
+def analyze_files(paths, lower=1.0e-10, upper=1.0, connectivity=26, periodic=(False, False, False),
+                  estimators=blob_moments.ESTIMATORS, kernels='auto', workers=1, read_threads=1):
+    """{estimator: (vol, com, inertia)} of every blob of one timestep, and its AssemblyReport.
+
+    The subdomain files `paths` are labelled and reduced one block per task
+    in `workers` processes (in this one for workers <= 1); read_threads file
+    headers are read concurrently. Raises ValueError if blocks overlap.
+    """
+    paths = list(paths)
+    x, y, z, extents, report = layout(paths, read_threads)
+    options = dict(lower=lower, upper=upper, connectivity=connectivity, estimators=_needed(estimators), kernels=kernels)
+    job = functools.partial(_label_job, options=options)
+    jobs = block_jobs(paths, x, y, z, extents)
+    blocks = list(_executor(workers).map(job, jobs) if workers > 1 else map(job, jobs))
+    shape = (x.size - 1, y.size - 1, z.size - 1)
+    return stitch_blocks(blocks, extents, shape, connectivity, periodic, estimators), report
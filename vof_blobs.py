@@ -0,0 +1,268 @@
+"""Blob statistics from PARIS VOF output under plain python, no ParaView needed.
+
+    python vof_blobs.py PARIS_Experiments/2_droplet_experiments
+
+Every experiment directory with a VTK/ subdirectory is processed in sorted
+order. Each timestep's subdomain files are stitched into one structured grid,
+labelled, and reduced to per-blob volume, COM and MOI for the center,
+arithmetic and geometric liquid-position estimators (or the subset given
+with --estimators), written to output_<estimator>.csv in the experiments
+directory (same columns and estimators as visualization.py).
+"""
+import argparse
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import assemble
+import blob_moments
+import catalog
+import labeling
+import moment_kernels
+import prefetch
+import result_cache
+import results
+import scheduler
+import slabs
+import subdomains
+import vof_store
+
+
+def _cache_entry(vtk_dir, paths, lower, upper, connectivity, periodic, estimators, cache_dir):
+    #(cache, experiment, key) under which a timestep's tables are cached, None without a cache_dir
+    if cache_dir is None:
+        return None
+    experiment = os.path.basename(os.path.dirname(os.path.abspath(vtk_dir)))
+    params = dict(backend='native', lower=lower, upper=upper, connectivity=connectivity,
+                  periodic=list(periodic), estimators=list(estimators))
+    return result_cache.ResultCache(cache_dir), experiment, result_cache.fingerprint(paths, params)
+
+
+def _stitch(vtk_dir, tstep, paths, read_threads, use_store):
+    #(grid, report) of one timestep, from the experiment's VOF store when it is up to date
+    if use_store:
+        grid = vof_store.read_timestep(vtk_dir, tstep, paths)
+        if grid is not None:
+            return grid, assemble.AssemblyReport([], 0, [])
+    return assemble.assemble_files(paths, threads=read_threads)
+
+
+def read_timestep(vtk_dir, exp, tstep, paths, lower=1.0e-10, upper=1.0, connectivity=26,
+                  periodic=(False, False, False), estimators=blob_moments.ESTIMATORS, cache_dir=None,
+                  read_threads=1, use_store=False, kernels='auto', subdomain_workers=0, slab_budget=None):
+    #the stitched (grid, report) of one timestep for analyze_timestep, None if its tables are cached
+    #or it is analysed by subdomain or slab (nothing to read ahead)
+    entry = _cache_entry(vtk_dir, paths, lower, upper, connectivity, periodic, estimators, cache_dir)
+    if subdomain_workers or slab_budget or (entry is not None and entry[0].has(entry[1], tstep, entry[2])):
+        return None
+    return _stitch(vtk_dir, tstep, paths, read_threads, use_store)
+
+
+def analyze_timestep(vtk_dir, exp, tstep, paths, lower=1.0e-10, upper=1.0, connectivity=26,
+                     periodic=(False, False, False), estimators=blob_moments.ESTIMATORS, cache_dir=None,
+                     read_threads=1, use_store=False, kernels='auto', subdomain_workers=0, slab_budget=None,
+                     loaded=None):
+    """Label one timestep (its subdomain files `paths`) and return {estimator: rows of its output table}.
+
+    Only the given estimators are computed; corners are not interpolated at
+    all for 'center' alone. kernels picks the moment_kernels backend.
+
+    With a cache_dir the tables are looked up by the fingerprint of the input
+    files and parameters first, and stored there after computing them.
+    read_threads subdomain files are read concurrently, or with use_store the
+    merged grid is taken from the experiment's vof_store when it holds these
+    files; `loaded` is a stitched (grid, report) that was already read ahead.
+    With subdomain_workers >= 1 the grid is never merged: the subdomain files
+    are labelled separately in that many processes and their blobs stitched
+    (subdomains.analyze_files). With a slab_budget (bytes) the timestep is
+    streamed out of core in z slabs sized to it (slabs.analyze), from the
+    store with use_store or from the memory-mapped files.
+    """
+    entry = _cache_entry(vtk_dir, paths, lower, upper, connectivity, periodic, estimators, cache_dir)
+    if entry is not None:
+        cache, experiment, key = entry
+        tables = cache.get(experiment, tstep, key, exp=exp)
+        if tables is not None:
+            return tables
+
+    if slab_budget:
+        reader, store = slabs.open_reader(vtk_dir, tstep, paths, use_store, read_threads)
+        try:
+            moments = slabs.analyze(reader, lower, upper, connectivity, periodic, estimators, kernels, slab_budget)
+        finally:
+            if store is not None:
+                store.close()
+        report = reader.report
+    elif subdomain_workers:
+        moments, report = subdomains.analyze_files(paths, lower, upper, connectivity, periodic, estimators, kernels,
+                                                   subdomain_workers, read_threads)
+    else:
+        if loaded is None:
+            loaded = _stitch(vtk_dir, tstep, paths, read_threads, use_store)
+        grid, report = loaded
+        labels, counts = labeling.label(grid.vof, lower, upper, connectivity, periodic)
+        moments = moment_kernels.grid_moments(grid, labels, counts.size, estimators, kernels)
+    if report.gaps or report.overlaps:
+        print('%s timestep %d: %s' % (vtk_dir, tstep, assemble.format_report(report)))
+    tables = {name: blob_moments.moment_table(exp, tstep, *moments[name]) for name in estimators}
+
+    if entry is not None:
+        cache.put(experiment, tstep, key, tables)
+    return tables
+
+
+def analyze_serial(tasks, prefetch_depth=0, **options):
+    """Yield the tables of every task, in order, in this process.
+
+    With prefetch_depth >= 2 the next timesteps are read and stitched in a
+    background thread while the current one is labelled, holding at most
+    prefetch_depth stitched grids at a time.
+    """
+    def read(task):
+        return read_timestep(*task, **options)
+
+    for task, loaded in prefetch.prefetch(tasks, read, prefetch_depth):
+        yield analyze_timestep(*task, loaded=loaded, **options)
+
+
+def analyze_experiment(experiment, prefetch_depth=0, **options):
+    #all timesteps of one scheduler.Experiment, serially, as one table per estimator
+    vof_catalog = experiment.catalog
+    tasks = [(experiment.vtk_dir, experiment.index, ii, vof_catalog.paths(ii)) for ii in vof_catalog.timesteps]
+    tables = list(analyze_serial(tasks, prefetch_depth, **options))
+    return {name: np.vstack([t[name] for t in tables]) if tables else np.zeros((0, 13))
+            for name in options.get('estimators', blob_moments.ESTIMATORS)}
+
+
+def timestep_tasks(top_dir, exps):
+    #(vtk_dir, exp, tstep, paths) for every complete timestep of every experiment, in output order
+    tasks = []
+    for aa in range(len(exps)):
+        vtk_dir = catalog.experiment_vtk_dir(top_dir, exps[aa])
+        vof_catalog = catalog.load(vtk_dir)
+        if not vof_catalog.complete:
+            print(catalog.format_report(vof_catalog))
+        tasks.extend((vtk_dir, aa, ii, vof_catalog.paths(ii)) for ii in vof_catalog.timesteps)
+    return tasks
+
+
+def _run_task(task, options):
+    return analyze_timestep(*task, **options)
+
+
+def run_tasks(tasks, workers=1, prefetch_depth=0, **options):
+    """Yield the tables of every task, in task order.
+
+    With workers > 1 the timesteps are farmed out to a process pool; results
+    still come back in (exp, tstep) order so the output is deterministic.
+    Serially, prefetch_depth is passed on to analyze_serial; the pool already
+    overlaps reading and labelling across processes.
+    """
+    if workers <= 1:
+        yield from analyze_serial(tasks, prefetch_depth, **options)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for table in pool.map(functools.partial(_run_task, options=options), tasks):
+            yield table
+
+
+def add_analysis_arguments(parser):
+    #the options of the analysis itself, shared with mpi_blobs.py
+    parser.add_argument('experiments', help='directory holding one directory per experiment')
+    parser.add_argument('--lower', type=float, default=1.0e-10, help='smallest VOF counted as liquid')
+    parser.add_argument('--upper', type=float, default=1.0, help='largest VOF counted as liquid')
+    parser.add_argument('--connectivity', type=int, choices=(6, 18, 26), default=26,
+                        help='cells sharing a face (6), edge (18) or corner (26) are connected')
+    parser.add_argument('--periodic', default='', help='periodic axes, e.g. "xz"')
+    parser.add_argument('--estimators', type=blob_moments.select_estimators, default=blob_moments.ESTIMATORS,
+                        help='comma separated subset of %s to compute' % ','.join(blob_moments.ESTIMATORS))
+    parser.add_argument('--kernels', choices=moment_kernels.KERNELS, default='auto',
+                        help='per-cell moment kernels: numba (compiled, all cores) when installed, else numpy')
+    parser.add_argument('--read-threads', type=int, default=1,
+                        help='subdomain files of a timestep read concurrently (hides network filesystem latency)')
+    parser.add_argument('--store', action='store_true',
+                        help='read merged timesteps from each experiment\'s VOF store (vof_store.py) where up to date')
+    parser.add_argument('--cache-dir', default=None,
+                        help='per-timestep result cache (default: <experiments>/.blob_cache)')
+    parser.add_argument('--no-cache', action='store_true', help='recompute every timestep')
+    parser.add_argument('--npy', action='store_true',
+                        help='also write the rows as .npy chunks to output_<estimator>/ next to the CSVs')
+
+
+def analysis_options(args):
+    #analyze_timestep keyword arguments from the add_analysis_arguments options
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = args.cache_dir or os.path.join(args.experiments, '.blob_cache')
+    return dict(lower=args.lower, upper=args.upper, connectivity=args.connectivity,
+                periodic=tuple(axis in args.periodic.lower() for axis in 'xyz'), estimators=args.estimators,
+                cache_dir=cache_dir, read_threads=args.read_threads, use_store=args.store, kernels=args.kernels)
+
+
+def write_tables(args, tables):
+    """Append every timestep's {estimator: rows} to output_<estimator>.csv in the experiments directory."""
+    #rows go to disk in batches as timesteps finish instead of one savetxt at the end
+    writers = {}
+    for name in args.estimators:
+        output = os.path.join(args.experiments, 'output_' + name)
+        writers[name] = results.ResultWriter(output + '.csv', blob_moments.HEADER, output if args.npy else None)
+    try:
+        for timestep_tables in tables:
+            for name, writer in writers.items():
+                writer.append(timestep_tables[name])
+    finally:
+        for writer in writers.values():
+            writer.close()
+    print(writers[args.estimators[0]].rows)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    add_analysis_arguments(parser)
+    parser.add_argument('--workers', type=int, default=1, help='timesteps (or experiments) analysed in parallel processes')
+    parser.add_argument('--subdomains', action='store_true',
+                        help='label every subdomain file separately (--workers processes per timestep) and stitch the '
+                             'blobs across processor boundaries, never merging the grid')
+    parser.add_argument('--slabs', action='store_true',
+                        help='stream every timestep out of core in z slabs that fit --memory-budget (default 1 GB per worker)')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='read up to N timesteps ahead while labelling (2 = double buffering)')
+    parser.add_argument('--schedule', choices=('timesteps', 'experiments'), default='timesteps',
+                        help='farm out single timesteps, or whole experiments largest first')
+    parser.add_argument('--memory-budget', type=float, default=None,
+                        help='GB the concurrently running experiments (--schedule experiments) or slabs (--slabs) may use')
+    args = parser.parse_args(argv)
+    if args.subdomains and (args.store or args.schedule == 'experiments' or args.slabs):
+        parser.error('--subdomains reads the subdomain files timestep by timestep, '
+                     'it does not combine with --store, --slabs or --schedule experiments')
+    if args.slabs and args.schedule == 'experiments':
+        parser.error('--slabs budgets the timesteps, not whole experiments; use --schedule timesteps')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    exps = catalog.find_experiments(args.experiments)
+    print(exps)
+    options = analysis_options(args)
+    if args.slabs:
+        #every worker streams its own timestep, the budget is shared between them
+        options['slab_budget'] = (1.0 if args.memory_budget is None else args.memory_budget)*1e9/max(args.workers, 1)
+    if args.subdomains:
+        #the workers share out the subdomains of one timestep at a time
+        options['subdomain_workers'] = args.workers
+        tables = run_tasks(timestep_tasks(args.experiments, exps), 1, 0, **options)
+    elif args.schedule == 'experiments':
+        experiments = scheduler.survey(args.experiments, exps)
+        budget = None if args.memory_budget is None else args.memory_budget*1e9
+        analyze = functools.partial(analyze_experiment, prefetch_depth=args.prefetch, **options)
+        tables = scheduler.run_largest_first(experiments, analyze, args.workers, budget)
+    else:
+        tables = run_tasks(timestep_tasks(args.experiments, exps), args.workers, args.prefetch, **options)
+    write_tables(args, tables)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""Chunked, compressed store of the merged VOF time series of an experiment.
+
+    python vof_store.py PARIS_Experiments/2_droplet_experiments --slab 32
+
+Every complete timestep is read once, stitched into the global grid and
+written in z slabs of `slab` cells, each compressed separately, so a later
+pass reads one timestep or a few slabs of it without touching or merging
+the per-processor .vtk files. Two layouts with the same interface:
+
+  <experiment>/VOF.store/   a directory of zlib compressed .npz slabs (NumPy only)
+  <experiment>/VOF.h5       one HDF5 file, dataset 'vof' chunked per slab (needs h5py)
+
+Values keep the dtype of the .vtk payload. Each timestep records the
+fingerprint of the files it came from, so converting again only rewrites
+timesteps that are new or whose files changed.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+import assemble
+import catalog
+import result_cache
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+STORE_NAME = 'VOF.store'
+HDF5_NAME = 'VOF.h5'
+
+
+def default_path(vtk_dir, hdf5=False):
+    #the store of the experiment that vtk_dir belongs to
+    return os.path.join(os.path.dirname(os.path.normpath(vtk_dir)), HDF5_NAME if hdf5 else STORE_NAME)
+
+
+def source_key(paths):
+    #fingerprint of the .vtk files a timestep was converted from
+    return result_cache.source_fingerprint(paths)
+
+
+class NpyStore:
+    """Directory layout: grid.npz (node coordinates), index.json and one <tstep>-<slab>.npz per slab.
+
+    Slabs are stored in file order, (nz, ny, nx), and handed out as [i, j, k]
+    views like paris_vtk.read_vof does.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.x = self.y = self.z = None
+        self.slab = None
+        self.keys = {}
+        if os.path.exists(os.path.join(path, 'grid.npz')):
+            with np.load(os.path.join(path, 'grid.npz')) as grid:
+                self.x, self.y, self.z = grid['x'], grid['y'], grid['z']
+                self.slab = int(grid['slab'])
+            with open(os.path.join(path, 'index.json')) as f:
+                self.keys = {int(tstep): key for tstep, key in json.load(f).items()}
+        elif mode == 'r':
+            raise FileNotFoundError('%s: no VOF store' % path)
+
+    @property
+    def timesteps(self):
+        return sorted(self.keys)
+
+    def _chunk(self, tstep, n):
+        return os.path.join(self.path, '%05d-%05d.npz' % (tstep, n))
+
+    def _save_index(self):
+        with open(os.path.join(self.path, 'index.json.tmp'), 'w') as f:
+            json.dump({str(tstep): key for tstep, key in sorted(self.keys.items())}, f)
+        os.replace(os.path.join(self.path, 'index.json.tmp'), os.path.join(self.path, 'index.json'))
+
+    def write(self, tstep, grid, key, slab=32):
+        if self.x is None:
+            os.makedirs(self.path, exist_ok=True)
+            self.x, self.y, self.z, self.slab = grid.x, grid.y, grid.z, slab
+            np.savez(os.path.join(self.path, 'grid.npz'), x=grid.x, y=grid.y, z=grid.z, slab=slab)
+        _check_grid(self, grid)
+        #the index only lists a timestep once all of its slabs are on disk
+        self.keys.pop(tstep, None)
+        self._save_index()
+        for n, k0 in enumerate(range(0, grid.vof.shape[2], self.slab)):
+            np.savez_compressed(self._chunk(tstep, n), vof=grid.vof[:, :, k0:k0 + self.slab].transpose())
+        self.keys[tstep] = key
+        self._save_index()
+
+    def read(self, tstep, k0=0, k1=None, out=None):
+        """VofGrid of cells k0 <= k < k1 of one timestep (all of it by default)."""
+        k0, k1 = _slab_range(self, tstep, k0, k1)
+        first = k0 // self.slab
+        for n in range(first, (k1 - 1) // self.slab + 1):
+            with np.load(self._chunk(tstep, n)) as chunk:
+                values = chunk['vof'].transpose()
+            if out is None:
+                out = np.empty((self.x.size - 1, self.y.size - 1, k1 - k0), dtype=values.dtype)
+            lo = max(k0, n*self.slab)
+            hi = min(k1, (n + 1)*self.slab)
+            out[:, :, lo - k0:hi - k0] = values[:, :, lo - n*self.slab:hi - n*self.slab]
+        return assemble.VofGrid(self.x, self.y, self.z[k0:k1 + 1], out)
+
+    def close(self):
+        pass
+
+
+class H5Store:
+    """HDF5 layout: datasets x, y, z, tsteps, keys and vof (ntstep, nz, ny, nx), one gzip chunk per slab."""
+
+    def __init__(self, path, mode='r'):
+        if h5py is None:
+            raise ImportError('h5py is needed for HDF5 VOF stores, use a %s directory instead' % STORE_NAME)
+        self.path = path
+        self.file = h5py.File(path, 'r' if mode == 'r' else 'a')
+        self.x = self.y = self.z = None
+        self.slab = None
+        self.keys = {}
+        if 'vof' in self.file:
+            self.x, self.y, self.z = self.file['x'][()], self.file['y'][()], self.file['z'][()]
+            self.slab = int(self.file['vof'].chunks[1])
+            self.keys = {int(tstep): key.decode() for tstep, key in zip(self.file['tsteps'][()], self.file['keys'][()])
+                         if tstep >= 0}
+
+    @property
+    def timesteps(self):
+        return sorted(self.keys)
+
+    def _row(self, tstep):
+        return int(np.nonzero(self.file['tsteps'][()] == tstep)[0][0])
+
+    def write(self, tstep, grid, key, slab=32):
+        if self.x is None:
+            nx, ny, nz = grid.vof.shape
+            self.slab = min(slab, nz)
+            for name, coords in zip('xyz', (grid.x, grid.y, grid.z)):
+                self.file.create_dataset(name, data=coords)
+            self.file.create_dataset('vof', shape=(0, nz, ny, nx), maxshape=(None, nz, ny, nx), dtype=grid.vof.dtype,
+                                     chunks=(1, self.slab, ny, nx), compression='gzip', shuffle=True)
+            self.file.create_dataset('tsteps', shape=(0,), maxshape=(None,), dtype=np.int64)
+            self.file.create_dataset('keys', shape=(0,), maxshape=(None,), dtype='S16')
+            self.x, self.y, self.z = grid.x, grid.y, grid.z
+        _check_grid(self, grid)
+        tsteps = self.file['tsteps']
+        if tstep in self.keys:
+            row = self._row(tstep)
+        else:
+            row = tsteps.shape[0]
+            for name in ('vof', 'tsteps', 'keys'):
+                self.file[name].resize(row + 1, axis=0)
+        #mark the row unfinished until its values are written
+        tsteps[row] = -1
+        self.file['vof'][row] = grid.vof.transpose()
+        self.file['keys'][row] = key.encode()
+        tsteps[row] = tstep
+        self.file.flush()
+        self.keys[tstep] = key
+
+    def read(self, tstep, k0=0, k1=None, out=None):
+        """VofGrid of cells k0 <= k < k1 of one timestep (all of it by default)."""
+        k0, k1 = _slab_range(self, tstep, k0, k1)
+        values = self.file['vof'][self._row(tstep), k0:k1].transpose()
+        if out is not None:
+            out[...] = values
+            values = out
+        return assemble.VofGrid(self.x, self.y, self.z[k0:k1 + 1], values)
+
+    def close(self):
+        self.file.close()
+
+
+def _check_grid(store, grid):
+    #every timestep of a store shares one grid
+    for name in 'xyz':
+        stored, nodes = getattr(store, name), getattr(grid, name)
+        if stored.shape != nodes.shape or not np.allclose(stored, nodes):
+            raise ValueError('%s: timestep grid differs from the stored %s nodes' % (store.path, name))
+
+
+def _slab_range(store, tstep, k0, k1):
+    if tstep not in store.keys:
+        raise KeyError('%s: timestep %d is not stored' % (store.path, tstep))
+    nz = store.z.size - 1
+    k1 = nz if k1 is None else k1
+    if not 0 <= k0 < k1 <= nz:
+        raise ValueError('slab %d:%d outside 0:%d' % (k0, k1, nz))
+    return k0, k1
+
+
+def open_store(path, mode='r'):
+    """NpyStore or H5Store for path, by its extension; mode 'a' creates it if needed."""
+    if path.endswith(('.h5', '.hdf5')):
+        return H5Store(path, mode)
+    return NpyStore(path, mode)
+
+
+def read_timestep(vtk_dir, tstep, paths):
+    """Stored VofGrid of one timestep of the experiment owning vtk_dir.
+
+    None unless the experiment has a store holding this timestep converted
+    from the current `paths` (same names, sizes and mtimes).
+    """
+    for hdf5 in (False, True):
+        path = default_path(vtk_dir, hdf5)
+        if not os.path.exists(path) or (hdf5 and h5py is None):
+            continue
+        store = open_store(path)
+        try:
+            if store.keys.get(tstep) == source_key(paths):
+                return store.read(tstep)
+        finally:
+            store.close()
+    return None
+
+
+def convert(vtk_dir, path=None, slab=32, read_threads=1, hdf5=False):
+    """Write every complete timestep of vtk_dir to the store at path.
+
+    Timesteps already stored from unchanged files are skipped. Returns the
+    number of timesteps written.
+    """
+    vof_catalog = catalog.load(vtk_dir)
+    if not vof_catalog.complete:
+        print(catalog.format_report(vof_catalog))
+    store = open_store(path or default_path(vtk_dir, hdf5), 'a')
+    written = 0
+    try:
+        for tstep in vof_catalog.timesteps:
+            paths = vof_catalog.paths(tstep)
+            key = source_key(paths)
+            if store.keys.get(tstep) == key:
+                continue
+            grid, report = assemble.assemble_files(paths, dtype=None, threads=read_threads)
+            if report.gaps or report.overlaps:
+                print('%s timestep %d: %s' % (vtk_dir, tstep, assemble.format_report(report)))
+            store.write(tstep, grid, key, slab)
+            written += 1
+    finally:
+        store.close()
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('experiments', help='directory holding one directory per experiment')
+    parser.add_argument('--slab', type=int, default=32, help='z cells per compressed chunk')
+    parser.add_argument('--hdf5', action='store_true', help='write %s (needs h5py) instead of %s' % (HDF5_NAME, STORE_NAME))
+    parser.add_argument('--read-threads', type=int, default=1, help='subdomain files of a timestep read concurrently')
+    args = parser.parse_args(argv)
+
+    #the same experiments and complete timesteps as vof_blobs.py analyses
+    for name in catalog.find_experiments(args.experiments):
+        written = convert(catalog.experiment_vtk_dir(args.experiments, name), slab=args.slab,
+                          read_threads=args.read_threads, hdf5=args.hdf5)
+        print('%s: %d timesteps written' % (name, written))
+
+
+if __name__ == '__main__':
+    main()